@@ -0,0 +1,184 @@
+# Standard library imports
+import io
+import time
+import itertools
+from queue import Empty, PriorityQueue, Queue
+from threading import Event, Lock, Thread
+
+
+# Playback priorities (lower plays first)
+PRIORITY_ALERT = 0      # Short system sounds such as the shutter
+PRIORITY_SPEECH = 1     # Spoken prompts and captions
+
+# Seconds between interrupt checks while a streamed request waits for its next item
+ITEM_POLL_INTERVAL = 0.05
+
+
+
+class PlaybackRequest:
+    """One queued playback; wait on `done` to know when it finished or was interrupted."""
+
+    def __init__(self, items, priority):
+        self.items = items              # Iterable (or Queue ended by None) of sound names or encoded audio bytes, played back to back
+        self.priority = priority
+        self.done = Event()
+        self.started = Event()
+        self.started_at = None          # perf_counter() when the first item started playing
+        self.interrupted = False
+        self.generation = None          # Interrupt generation the request was submitted in
+
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+
+class AudioEngine:
+    """Single audio thread that owns the mixer, keeps system sounds decoded in memory and plays requests by priority."""
+
+    def __init__(self, sound_files):
+        self.sound_files = sound_files
+        self.sounds = {}                # Sound name -> decoded pygame Sound
+        self._queue = PriorityQueue()
+        self._order = itertools.count() # Keeps requests of equal priority in arrival order
+        self._interrupt = Event()
+        self._generation = 0            # Bumped by every interrupt; older requests are dropped
+        self._lock = Lock()
+        self._current = None
+        self._ready = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+        """Starts the audio thread and waits until the mixer and sounds are loaded."""
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+
+    def _load(self):
+        import pygame
+
+        pygame.mixer.init()
+        for name, path in self.sound_files.items():
+            self.sounds[name] = pygame.mixer.Sound(path)
+
+
+    def _decode(self, item):
+        """Turns a sound name or encoded audio bytes into a Sound."""
+        import pygame
+
+        if isinstance(item, str):
+            return self.sounds[item]
+        return pygame.mixer.Sound(file=io.BytesIO(item))
+
+
+    def _run(self):
+        self._load()
+        self._ready.set()
+        while True:
+            _, _, request = self._queue.get()
+            if request is None:
+                return
+            with self._lock:
+                if request.interrupted or request.generation < self._generation:
+                    request.interrupted = True
+                    request.done.set()
+                    continue
+                self._current = request
+                self._interrupt.clear()
+            try:
+                self._play(request)
+            except Exception as e:
+                print(f"An error occurred during playback: {e}")
+            finally:
+                with self._lock:
+                    self._current = None
+                request.done.set()
+
+
+    def _items(self, request):
+        """Yields the items of a request; a Queue is polled, so an interrupt is noticed while the next item is pending."""
+        if not isinstance(request.items, Queue):
+            yield from request.items
+            return
+
+        while not self._interrupt.is_set():
+            try:
+                item = request.items.get(timeout=ITEM_POLL_INTERVAL)
+            except Empty:
+                continue
+            if item is None:
+                return
+            yield item
+
+
+    def _play(self, request):
+        """Plays the items of a request gaplessly on one channel, stopping early on interrupt."""
+        channel = None
+        ends_at = None
+        for item in self._items(request):
+            if self._interrupt.is_set():
+                break
+            sound = self._decode(item)
+
+            if channel is None:
+                channel = sound.play()
+                request.started_at = time.perf_counter()
+                request.started.set()
+                ends_at = request.started_at + sound.get_length()
+                continue
+
+            # Queue the next item just before the current one ends so it follows without a gap
+            if self._interrupt.wait(max(0.0, ends_at - time.perf_counter() - 0.05)):
+                break
+            channel.queue(sound)
+            ends_at = max(ends_at, time.perf_counter()) + sound.get_length()
+
+        if channel is None:
+            request.started.set()
+            return
+
+        # Sleep until playback ends, waking immediately if interrupted
+        if self._interrupt.wait(max(0.0, ends_at - time.perf_counter())):
+            channel.stop()
+            request.interrupted = True
+
+
+    def submit(self, items, priority=PRIORITY_SPEECH):
+        """Queues items for playback and returns the PlaybackRequest."""
+        request = PlaybackRequest(items, priority)
+        with self._lock:
+            request.generation = self._generation
+        self._queue.put((priority, next(self._order), request))
+        return request
+
+
+    def play(self, name, priority=PRIORITY_ALERT):
+        """Queues a preloaded sound by name."""
+        return self.submit([name], priority)
+
+
+    def interrupt(self):
+        """Stops the current playback and drops everything still queued (barge-in)."""
+        with self._lock:
+            self._generation += 1
+            if self._current is not None:
+                self._current.interrupted = True
+            pending = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            for _, _, request in pending:
+                if request is None:
+                    self._queue.put((-1, -1, None))     # Keep a pending shutdown
+                    continue
+                request.interrupted = True
+                request.done.set()
+            self._interrupt.set()
+
+
+    def stop(self):
+        """Interrupts playback and ends the audio thread."""
+        self.interrupt()
+        self._queue.put((-1, -1, None))
+        self._thread.join(timeout=1)
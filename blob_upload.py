@@ -0,0 +1,170 @@
+# Standard library imports
+import os
+import time
+import json
+import base64
+import hashlib
+import mimetypes
+from threading import Lock
+
+# Third-party imports
+from azure.storage.blob import BlobBlock, ContentSettings
+
+
+# Default block size for staged uploads
+BLOCK_SIZE = 1024 * 1024    # 1 MB
+
+# Default re-encoding settings
+JPEG_QUALITY = 85
+MAX_DIMENSION = None        # Longest side in pixels after downscaling, None keeps the original size
+
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all upload threads that caps the total upload rate."""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self._available = bytes_per_second
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+
+    def consume(self, size):
+        """Blocks until `size` bytes may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.rate, self._available + (now - self._last) * self.rate)
+            self._last = now
+            self._available -= size
+            wait = -self._available / self.rate if self._available < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+
+def compress_image(file_path, quality=JPEG_QUALITY, max_dimension=MAX_DIMENSION):
+    """Re-encodes an image as JPEG and returns the path of the compressed copy.
+
+    The copy is kept next to the original until the upload is committed, so a
+    resumed upload sends exactly the same bytes as the interrupted one.
+    """
+    compressed_path = file_path + ".upload.jpg"
+    if os.path.exists(compressed_path):
+        return compressed_path
+
+    import numpy as np
+    import simplejpeg
+    from PIL import Image
+
+    with Image.open(file_path) as image:
+        image = image.convert("RGB")
+        if max_dimension and max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension))
+        data = simplejpeg.encode_jpeg(np.asarray(image), quality=quality, colorspace="RGB")
+
+    tmp_path = compressed_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, compressed_path)
+    return compressed_path
+
+
+
+def _block_id(index, chunk):
+    """Builds a fixed-length block id from the block position and content."""
+    raw = f"{index:06d}-{hashlib.sha1(chunk).hexdigest()[:16]}"
+    return base64.b64encode(raw.encode()).decode()
+
+
+
+class ResumableBlobUploader:
+    """Uploads files as staged blocks and persists the staged block list so interrupted uploads resume.
+
+    The staged block ids of each entry are kept in the history store's sync
+    state; only blocks that are not already staged are sent on the next run.
+    """
+
+    def __init__(self, history, block_size=BLOCK_SIZE, limiter=None, compress=False,
+                 quality=JPEG_QUALITY, max_dimension=MAX_DIMENSION):
+        self.history = history
+        self.block_size = block_size
+        self.limiter = limiter
+        self.compress = compress
+        self.quality = quality
+        self.max_dimension = max_dimension
+        self.bytes_sent = 0
+        self.bytes_skipped = 0      # Bytes of blocks that were already staged by an earlier run
+        self._lock = Lock()
+
+
+    @staticmethod
+    def _state_key(blob_name):
+        return f"staged_blocks:{blob_name}"
+
+
+    def _load_staged(self, blob_client, blob_name, size):
+        """Returns the block ids staged by a previous attempt that storage still holds."""
+        saved = self.history.get_state(self._state_key(blob_name))
+        if not saved:
+            return set()
+
+        saved = json.loads(saved)
+        if saved.get("size") != size:
+            return set()    # The source changed since the interrupted attempt
+
+        # Uncommitted blocks expire on the server, so only trust ids it still reports
+        try:
+            _, uncommitted = blob_client.get_block_list("uncommitted")
+        except Exception:
+            return set()
+        return set(saved["blocks"]) & {block.id for block in uncommitted}
+
+
+    def _save_staged(self, blob_name, size, staged):
+        self.history.set_state(self._state_key(blob_name), json.dumps(dict(size=size, blocks=sorted(staged))))
+
+
+    def upload(self, client, file_path, blob_name=None):
+        """Uploads a file in blocks (re-encoding it first if enabled) and commits the block list."""
+        blob_name = blob_name or file_path
+        source_path = compress_image(file_path, self.quality, self.max_dimension) if self.compress else file_path
+        content_type = mimetypes.guess_type(source_path)[0] or "application/octet-stream"
+
+        blob_client = client.get_blob_client(blob_name)
+        size = os.path.getsize(source_path)
+        staged = self._load_staged(blob_client, blob_name, size)
+
+        block_ids = []
+        with open(source_path, "rb") as file:
+            index = 0
+            while True:
+                chunk = file.read(self.block_size)
+                if not chunk:
+                    break
+                block_id = _block_id(index, chunk)
+                block_ids.append(block_id)
+                index += 1
+
+                if block_id in staged:
+                    with self._lock:
+                        self.bytes_skipped += len(chunk)
+                    continue
+
+                if self.limiter is not None:
+                    self.limiter.consume(len(chunk))
+                blob_client.stage_block(block_id, chunk, length=len(chunk))
+                staged.add(block_id)
+                self._save_staged(blob_name, size, staged)
+                with self._lock:
+                    self.bytes_sent += len(chunk)
+
+        blob_client.commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids],
+            content_settings=ContentSettings(content_type=content_type),
+        )
+
+        # The upload is complete, so the resume state and the compressed copy are no longer needed
+        self.history.set_state(self._state_key(blob_name), None)
+        if source_path != file_path:
+            os.remove(source_path)
@@ -0,0 +1,108 @@
+# Standard library imports
+import time
+from queue import Queue
+from threading import Lock, Thread
+from collections import namedtuple
+
+
+# Default GPIO pin and timing constants
+BUTTON_PIN = 16
+SHORT_PRESS_TIME = 0.5  # Presses shorter than this (in seconds) are short presses, longer ones are long presses
+BOUNCE_TIME_MS = 50     # Edges closer together than this (in milliseconds) are treated as contact bounce
+
+# Press kinds
+SHORT_PRESS = "short"
+LONG_PRESS = "long"
+
+
+# A completed button press; timestamps come from time.monotonic()
+PressEvent = namedtuple("PressEvent", ["kind", "pressed_at", "released_at", "duration"])
+
+
+
+class ButtonSource:
+    """Turns press/release edges into timestamped PressEvents on a queue.
+
+    Subclasses deliver edges by calling _on_edge() from whatever thread
+    observes them (a GPIO interrupt callback or a simulation thread).
+    """
+
+    def __init__(self, short_press_time=SHORT_PRESS_TIME):
+        self.short_press_time = short_press_time
+        self.events = Queue()
+        self._pressed_at = None
+        self._lock = Lock()
+
+
+    def _on_edge(self, pressed, timestamp=None):
+        """Records a press or release edge and queues a PressEvent on release."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            if pressed:
+                self._pressed_at = timestamp
+                return
+            if self._pressed_at is None:
+                return  # Release without a matching press (e.g. button held at startup)
+
+            duration = timestamp - self._pressed_at
+            kind = SHORT_PRESS if duration < self.short_press_time else LONG_PRESS
+            self.events.put(PressEvent(kind, self._pressed_at, timestamp, duration))
+            self._pressed_at = None
+
+
+    def get(self, timeout=None):
+        """Blocks until the next press event is available (raises queue.Empty on timeout)."""
+        return self.events.get(timeout=timeout)
+
+
+    def start(self):
+        pass
+
+
+    def stop(self):
+        pass
+
+
+
+class GPIOButtonSource(ButtonSource):
+    """Edge-triggered button on a Raspberry Pi GPIO pin with hardware debounce."""
+
+    def __init__(self, pin=BUTTON_PIN, bounce_time_ms=BOUNCE_TIME_MS, short_press_time=SHORT_PRESS_TIME):
+        super().__init__(short_press_time)
+        self.pin = pin
+        self.bounce_time_ms = bounce_time_ms
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+
+    def _callback(self, channel):
+        # The button pulls the pin low while it is held down
+        self._on_edge(self.GPIO.input(channel) == self.GPIO.LOW)
+
+
+    def start(self):
+        """Configures the pin and registers the interrupt callback."""
+        self.GPIO.setmode(self.GPIO.BCM)
+        self.GPIO.setup(self.pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+        self.GPIO.add_event_detect(self.pin, self.GPIO.BOTH, callback=self._callback, bouncetime=self.bounce_time_ms)
+
+
+    def stop(self):
+        self.GPIO.remove_event_detect(self.pin)
+
+
+
+class SimulatedButtonSource(ButtonSource):
+    """Button driven from software, for running and measuring the pipeline without a Pi."""
+
+    def press(self, duration=0.1, wait=False):
+        """Simulates holding the button for `duration` seconds, in the background unless `wait` is set."""
+        def run():
+            self._on_edge(True)
+            time.sleep(duration)
+            self._on_edge(False)
+
+        if wait:
+            run()
+        else:
+            Thread(target=run, daemon=True).start()
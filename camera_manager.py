@@ -0,0 +1,236 @@
+# Standard library imports
+import os
+import time
+import itertools
+from threading import Lock, Timer
+
+# Imports for image processing
+import cv2
+
+# Per-stage latency tracing
+import tracing
+
+
+# Seconds of inactivity before the sensor is powered down
+IDLE_TIMEOUT = 30
+
+# Upper bound on how long to wait for auto-exposure / auto-white-balance after a cold start
+CONVERGENCE_TIMEOUT = 2.0
+
+# Relative change between consecutive frames below which exposure and colour gains count as settled
+CONVERGENCE_TOLERANCE = 0.02
+
+
+
+def _settled(previous, current, key):
+    """Checks whether a metadata value changed by less than the tolerance between two frames."""
+    if key not in previous or key not in current:
+        return True
+
+    old, new = previous[key], current[key]
+    if isinstance(old, (tuple, list)):
+        return all(abs(n - o) <= CONVERGENCE_TOLERANCE * max(abs(o), 1e-6) for o, n in zip(old, new))
+    return abs(new - old) <= CONVERGENCE_TOLERANCE * max(abs(old), 1e-6)
+
+
+
+def yuv420_to_rgb(frame):
+    """Converts a planar YUV420 (I420: Y, then U, then V) array, as produced by the lores stream, to an RGB array."""
+    return cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_I420)
+
+
+
+class CameraManager:
+    """Keeps a Picamera2 session streaming between presses and stops it after an idle period."""
+
+    def __init__(self, picam2, idle_timeout=IDLE_TIMEOUT, convergence_timeout=CONVERGENCE_TIMEOUT):
+        self.picam2 = picam2
+        self.idle_timeout = idle_timeout
+        self.convergence_timeout = convergence_timeout
+        self.running = False
+        self.last_metadata = {}         # Metadata of the most recent frame
+        self.converged = False          # Whether AE/AWB settled before the last capture
+        self.convergence_time = None    # Seconds spent waiting for AE/AWB after the last cold start
+        self._lock = Lock()
+        self._idle_timer = None
+        self._idle_generation = 0       # Bumped on every capture so a stale idle timer is ignored
+
+
+    def wait_for_convergence(self):
+        """Waits until AE/AWB report locked or exposure and colour gains stop changing."""
+        start_time = time.perf_counter()
+        previous = self.picam2.capture_metadata()
+        self.converged = False
+
+        while time.perf_counter() - start_time < self.convergence_timeout:
+            current = self.picam2.capture_metadata()
+            ae_locked = current.get("AeLocked")
+            if ae_locked is None:
+                ae_locked = _settled(previous, current, "ExposureTime") and _settled(previous, current, "AnalogueGain")
+            awb_settled = _settled(previous, current, "ColourGains")
+            previous = current
+
+            if ae_locked and awb_settled:
+                self.converged = True
+                break
+
+        self.last_metadata = previous
+        self.convergence_time = time.perf_counter() - start_time
+        print(f"Camera exposure {'converged' if self.converged else 'timed out'} after {self.convergence_time:.2f}s")
+
+
+    def _ensure_running(self):
+        """Starts the camera if it is powered down and waits only as long as AE/AWB needs."""
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+        if not self.running:
+            with tracing.span("camera_start"):
+                self.picam2.start()
+                self.running = True
+                self.wait_for_convergence()
+
+
+    def _schedule_idle_stop(self):
+        """Restarts the countdown after which the sensor is powered down."""
+        self._idle_generation += 1
+        self._idle_timer = Timer(self.idle_timeout, self._idle_stop, args=(self._idle_generation,))
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+
+    def capture_arrays(self, streams=("main",)):
+        """Returns the latest frame of each named stream, all taken from the same request."""
+        with self._lock:
+            self._ensure_running()
+            request = self.picam2.capture_request()
+            try:
+                frames = {name: request.make_array(name) for name in streams}
+                self.last_metadata = request.get_metadata()
+            finally:
+                request.release()
+            self._schedule_idle_stop()
+        return frames
+
+
+    def capture_array(self, stream="main"):
+        """Returns the latest frame of one stream from the streaming camera as an array."""
+        return self.capture_arrays((stream,))[stream]
+
+
+    def capture_file(self, filename):
+        """Saves the latest frame from the streaming camera to a file."""
+        with self._lock:
+            self._ensure_running()
+            self.last_metadata = self.picam2.capture_file(filename) or self.last_metadata
+            self._schedule_idle_stop()
+
+
+    def _idle_stop(self, generation):
+        """Stops the camera unless a capture happened after this timer was scheduled."""
+        with self._lock:
+            if generation != self._idle_generation or not self.running:
+                return
+            self._idle_timer = None
+            self.picam2.stop()
+            self.running = False
+
+
+    def stop(self):
+        """Powers the sensor down until the next capture."""
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if self.running:
+                self.picam2.stop()
+                self.running = False
+
+
+
+class _SimulatedRequest:
+    """Completed request of the simulated camera, holding one frame per configured stream."""
+
+    def __init__(self, arrays, metadata):
+        self.arrays = arrays
+        self.metadata = metadata
+
+    def make_array(self, name):
+        return self.arrays[name]
+
+    def get_metadata(self):
+        return self.metadata
+
+    def release(self):
+        pass
+
+
+
+class SimulatedPicamera2:
+    """Stand-in for Picamera2 that serves the images of a directory in turn, for running the pipeline without a Pi.
+
+    Frames are scaled to each configured stream size and converted to its
+    format (XBGR8888 or YUV420), so CameraManager and yuv420_to_rgb run unchanged.
+    """
+
+    def __init__(self, image_dir, start_delay=0.0):
+        from PIL import Image
+
+        extensions = (".jpg", ".jpeg", ".png", ".bmp")
+        paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir) if name.lower().endswith(extensions))
+        if not paths:
+            raise ValueError(f"No sample images found in {image_dir}")
+
+        self.images = [Image.open(path).convert("RGB") for path in paths]
+        self.start_delay = start_delay  # Seconds the sensor takes to start streaming
+        self.streams = {}               # Stream name -> (size, format)
+        self.started = False
+        self._next_image = itertools.cycle(range(len(self.images)))
+        self._frame_id = 0
+
+
+    def create_preview_configuration(self, main, lores=None):
+        config = dict(main=main)
+        if lores is not None:
+            config["lores"] = lores
+        return config
+
+
+    def configure(self, config):
+        self.streams = {name: (tuple(stream["size"]), stream.get("format", "XBGR8888")) for name, stream in config.items()}
+
+
+    def start(self):
+        time.sleep(self.start_delay)
+        self.started = True
+
+
+    def stop(self):
+        self.started = False
+
+
+    def capture_metadata(self):
+        self._frame_id += 1
+        return {"AeLocked": True, "ExposureTime": 10000, "AnalogueGain": 1.0, "ColourGains": (1.5, 1.5), "FrameId": self._frame_id}
+
+
+    def _array(self, image, size, fmt):
+        import numpy as np
+
+        rgb = np.asarray(image.resize(size))
+        if fmt == "YUV420":
+            return cv2.cvtColor(rgb, cv2.COLOR_RGB2YUV_I420)
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2RGBA)   # XBGR8888 arrays are in RGBX byte order
+
+
+    def capture_request(self):
+        image = self.images[next(self._next_image)]
+        arrays = {name: self._array(image, size, fmt) for name, (size, fmt) in self.streams.items()}
+        return _SimulatedRequest(arrays, self.capture_metadata())
+
+
+    def capture_file(self, filename):
+        image = self.images[next(self._next_image)]
+        image.resize(self.streams["main"][0]).save(filename)
+        return self.capture_metadata()
@@ -0,0 +1,215 @@
+# Standard library imports
+import time
+from threading import Lock
+from collections import OrderedDict
+
+# Third-party imports
+import cv2
+import numpy as np
+
+# Local imports
+import tracing
+
+
+# Default cache settings
+MAX_DISTANCE = 10       # Differing bits (of 64) up to which two frames count as the same scene
+TTL = 60                # Seconds a cached caption stays valid
+MAX_ENTRIES = 32        # Least recently used captions are dropped beyond this
+
+# Frames below this texture are never cached or answered from the cache: a dark room, a covered lens and a
+# blank wall all hash alike, so a match would describe another scene
+MIN_TEXTURE = 4.0       # Mean grey-level step between neighbouring pixels of a 32x32 thumbnail (x plus y)
+MIN_SET_BITS = 4        # Hashes with fewer set (or unset) bits than this are treated as flat
+
+
+
+def perceptual_hash(image):
+    """Returns the 64-bit difference hash (dHash) of an RGB frame or PIL image, or None for a flat frame.
+
+    The frame is reduced to 9x8 grey pixels and each bit records whether a
+    pixel is brighter than its right neighbour, so small changes in exposure,
+    noise or framing flip only a few bits. Frames with too little texture
+    (see MIN_TEXTURE and MIN_SET_BITS) get no hash.
+    """
+    frame = np.asarray(image)
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(np.ascontiguousarray(frame[:, :, :3]), cv2.COLOR_RGB2GRAY)
+
+    thumbnail = cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    texture = np.abs(np.diff(thumbnail, axis=1)).mean() + np.abs(np.diff(thumbnail, axis=0)).mean()
+    if texture < MIN_TEXTURE:
+        return None
+
+    small = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    if not MIN_SET_BITS <= bits.sum() <= bits.size - MIN_SET_BITS:
+        return None
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+
+class CaptionCache:
+    """LRU cache of recent captions keyed by perceptual hash, matched within a Hamming distance and a TTL."""
+
+    def __init__(self, max_distance=MAX_DISTANCE, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0                # Flat frames that bypassed the cache
+        self.time_saved = 0.0           # Estimated seconds of inference avoided by hits
+        self._inference_time = 0.0      # Total seconds of the inferences that filled the cache
+        self._inferences = 0
+        self._entries = OrderedDict()   # Hash -> (caption, policy, generation settings, time stored), least recently used first
+        self._lock = Lock()
+
+
+    def get(self, image_hash, policy=None):
+        """Returns (caption, generation settings, distance) of the closest live entry, or None."""
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if now - entry[3] > self.ttl]:
+                del self._entries[key]
+
+            best = None
+            for key, (caption, entry_policy, generation, _) in self._entries.items():
+                distance = (key ^ image_hash).bit_count()
+                if entry_policy == policy and distance <= self.max_distance and (best is None or distance < best[3]):
+                    best = (key, caption, generation, distance)
+
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best[0])
+            self.hits += 1
+            if self._inferences:
+                self.time_saved += self._inference_time / self._inferences
+            return best[1:]
+
+
+    def put(self, image_hash, caption, policy=None, generation=None, inference_time=None):
+        """Stores the caption of a frame, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[image_hash] = (caption, policy, generation, time.monotonic())
+            self._entries.move_to_end(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if inference_time is not None:
+                self._inference_time += inference_time
+                self._inferences += 1
+
+
+    def stats(self):
+        """Returns the hit rate and the estimated inference time saved."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries = len(self._entries),
+                hits = self.hits,
+                misses = self.misses,
+                skipped = self.skipped,
+                hit_rate = self.hits / lookups if lookups else None,
+                time_saved = self.time_saved,
+            )
+
+
+
+class CachedCaptionStream:
+    """Replays a cached caption with the interface of CaptionStream."""
+
+    def __init__(self, caption, lookup_time):
+        self.text = caption
+        self.time_to_first_word = lookup_time
+        self.total_time = lookup_time
+        self.done = True
+
+
+    def __iter__(self):
+        return iter(self.text.split())
+
+
+
+class _CachingStream:
+    """Passes a caption stream through and stores the finished caption in the cache."""
+
+    def __init__(self, stream, on_finish):
+        self._stream = stream
+        self._on_finish = on_finish
+
+
+    def __iter__(self):
+        yield from self._stream
+        self._on_finish(self._stream)
+
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+
+class CachedCaptioner:
+    """Answers near-duplicate frames from a CaptionCache in front of a CaptionEngine or InferenceProcess.
+
+    caption() and caption_stream() check the cache first; every other
+    attribute (load, is_loaded, stop, ...) is the wrapped engine's.
+    last_generation carries cacheHit and hashDistance for answered frames.
+    """
+
+    def __init__(self, engine, cache=None):
+        self.engine = engine
+        self.cache = cache or CaptionCache()
+        self.last_generation = None
+
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+
+    def _lookup(self, raw_image, policy):
+        """Hashes the frame and checks the cache; returns (hash, cached caption or None, lookup seconds)."""
+        start = time.perf_counter()
+        with tracing.span("caption_cache"):
+            image_hash = perceptual_hash(raw_image)
+            hit = self.cache.get(image_hash, policy) if image_hash is not None else None
+        lookup_time = time.perf_counter() - start
+        if image_hash is None:
+            self.cache.skipped += 1
+        if hit is None:
+            return image_hash, None, lookup_time
+
+        caption, generation, distance = hit
+        self.last_generation = dict(generation or {}, cacheHit=True, hashDistance=distance)
+        print(f"Caption answered from the cache in {lookup_time * 1000:.1f}ms (hash distance {distance})")
+        return image_hash, caption, lookup_time
+
+
+    def caption(self, raw_image, policy=None, deadline=None, cancelled=None):
+        """Returns the cached caption of a near-duplicate frame, or generates and caches a new one (unless cancelled)."""
+        image_hash, caption, _ = self._lookup(raw_image, policy)
+        if caption is not None:
+            return caption
+
+        self.last_generation = None
+        start = time.perf_counter()
+        caption = self.engine.caption(raw_image, policy, deadline, cancelled)
+        self.last_generation = self.engine.last_generation
+        # A cancelled caption is cut short, so it is never cached
+        if image_hash is not None and not (cancelled is not None and cancelled.is_set()):
+            self.cache.put(image_hash, caption, policy, self.last_generation, time.perf_counter() - start)
+        return caption
+
+
+    def caption_stream(self, raw_image, policy=None, deadline=None, cancelled=None):
+        """Returns a stream of the cached caption, or of a new caption that is cached once it has finished uncancelled."""
+        image_hash, caption, lookup_time = self._lookup(raw_image, policy)
+        if caption is not None:
+            return CachedCaptionStream(caption, lookup_time)
+
+        def on_finish(stream):
+            self.last_generation = self.engine.last_generation
+            if image_hash is not None and not stream.cancelled:
+                self.cache.put(image_hash, stream.text, policy, self.last_generation, stream.total_time)
+
+        self.last_generation = None
+        return _CachingStream(self.engine.caption_stream(raw_image, policy, deadline, cancelled), on_finish)
@@ -0,0 +1,635 @@
+# Standard library imports
+import os
+import time
+from threading import Lock, Thread
+from contextlib import nullcontext
+
+# Imports for image processing
+from PIL import Image
+
+# Per-stage latency tracing
+import tracing
+
+# Machine learning modules, imported by import_ml() on first load so startup does not wait for them
+torch = None
+transformers = None
+
+
+# Default pre-trained captioning model
+MODEL_NAME = "Salesforce/blip-image-captioning-base"
+
+# Setup base directory for file paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Directory holding the exported ONNX graphs
+onnx_dir = os.path.join(base_dir, "models", "onnx")
+
+# Maximum caption length used by the ONNX greedy decoder (matches the BLIP generation default)
+ONNX_MAX_LENGTH = 20
+
+# Named decoding strategies; the ONNX backend decodes greedily and only honours max_new_tokens
+GENERATION_POLICIES = {
+    "fast": dict(num_beams=1, max_new_tokens=12),
+    "balanced": dict(num_beams=1, max_new_tokens=20),
+    "quality": dict(num_beams=3, max_new_tokens=30, early_stopping=True),
+}
+DEFAULT_POLICY = "balanced"
+
+# Deadline mode never cuts a caption shorter than this many tokens
+MIN_DEADLINE_TOKENS = 5
+
+# Weight of the newest measurement in the running decode-time estimates
+DECODE_TIME_SMOOTHING = 0.3
+
+
+
+def import_ml():
+    """Imports torch and transformers (several seconds on a Pi) the first time a backend needs them."""
+    global torch, transformers
+    if torch is None:
+        import torch as _torch
+        import transformers as _transformers
+        torch, transformers = _torch, _transformers
+
+
+
+class _TimedTextStreamer:
+    """Text iterator streamer that also records when each generated token arrived."""
+
+    def __init__(self, tokenizer, token_times, **kwargs):
+        self.streamer = transformers.TextIteratorStreamer(tokenizer, **kwargs)
+        self.token_times = token_times
+
+    def put(self, value):
+        # The first call carries the prompt, which the wrapped streamer skips
+        if not (self.streamer.skip_prompt and self.streamer.next_tokens_are_prompt):
+            self.token_times.extend(time.perf_counter() for _ in value.reshape(-1).tolist())
+        self.streamer.put(value)
+
+    def end(self):
+        self.streamer.end()
+
+    def __iter__(self):
+        return iter(self.streamer)
+
+
+
+def _stopping_criteria(cancelled):
+    """Returns generate() options that stop decoding at the next token once the `cancelled` event is set."""
+    if cancelled is None:
+        return {}
+
+    class Cancelled(transformers.StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    return dict(stopping_criteria=transformers.StoppingCriteriaList([Cancelled()]))
+
+
+
+class TorchBackend:
+    """Runs the unmodified fp32 PyTorch model."""
+
+    name = "pytorch"
+
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self.processor = None
+        self.model = None
+        self.last_token_count = None
+
+
+    def load(self):
+        """Loads the processor and the fp32 model."""
+        import_ml()
+        self.processor = transformers.BlipProcessor.from_pretrained(self.model_name)
+        self.model = transformers.BlipForConditionalGeneration.from_pretrained(self.model_name)
+        self.model.eval()
+
+
+    def generate(self, raw_image, options=None, cancelled=None):
+        """Runs the processor and model on an RGB image and returns the decoded caption.
+
+        `options` are passed on to generate (e.g. max_new_tokens, num_beams); the
+        number of generated tokens is left in last_token_count. Decoding stops
+        early once the optional `cancelled` event is set.
+        """
+        with tracing.span("preprocess"):
+            inputs = self.processor(raw_image, return_tensors="pt")
+        with torch.inference_mode():
+            outputs = self.model.generate(**inputs, **(options or {}), **_stopping_criteria(cancelled))
+        self.last_token_count = outputs.shape[1] - 1    # Without the start token
+        return self.processor.decode(outputs[0], skip_special_tokens=True)
+
+
+    def generate_batch(self, raw_images, options=None):
+        """Captions a list of RGB images with one batched generate call."""
+        inputs = self.processor(images=raw_images, return_tensors="pt")
+        with torch.inference_mode():
+            outputs = self.model.generate(**inputs, **(options or {}))
+        return self.processor.batch_decode(outputs, skip_special_tokens=True)
+
+
+    def generate_stream(self, raw_image, token_times, options=None, cancelled=None):
+        """Yields caption text fragments (whole words) as the decoder produces them, appending token arrival times."""
+        options = options or {}
+        if options.get("num_beams", 1) > 1:
+            # Beam search only settles on the best sequence at the end, so the caption arrives in one piece
+            yield self.generate(raw_image, options, cancelled)
+            return
+
+        with tracing.span("preprocess"):
+            inputs = self.processor(raw_image, return_tensors="pt")
+        streamer = _TimedTextStreamer(self.processor.tokenizer, token_times, skip_prompt=True, skip_special_tokens=True)
+
+        errors = []
+
+        def run():
+            try:
+                with torch.inference_mode():
+                    self.model.generate(**inputs, streamer=streamer, **options, **_stopping_criteria(cancelled))
+            except Exception as e:
+                # generate() only ends the stream when it succeeds; end it here so the consumer below does not wait forever
+                errors.append(e)
+                streamer.end()
+
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+        if errors:
+            raise errors[0]
+
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """Runs the PyTorch model with its Linear layers dynamically quantized to int8."""
+
+    name = "int8"
+
+    def load(self):
+        """Loads the fp32 model and converts its Linear layers to dynamic int8."""
+        super().load()
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model.eval()
+
+
+
+def _text_decoder_wrapper(text_decoder):
+    """Exposes the BLIP text decoder with plain tensor inputs and logits output for ONNX export."""
+
+    class TextDecoderWrapper(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.text_decoder = text_decoder
+
+        def forward(self, input_ids, attention_mask, encoder_hidden_states):
+            return self.text_decoder(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                encoder_hidden_states=encoder_hidden_states,
+                return_dict=False,
+            )[0]
+
+    return TextDecoderWrapper()
+
+
+
+class OnnxBackend:
+    """Runs an ONNX Runtime export of the BLIP vision encoder and text decoder with greedy decoding."""
+
+    name = "onnx"
+
+    def __init__(self, model_name=MODEL_NAME, export_dir=onnx_dir):
+        self.model_name = model_name
+        self.export_dir = export_dir
+        self.processor = None
+        self.last_token_count = None
+        self.vision_session = None
+        self.decoder_session = None
+        self.bos_token_id = None
+        self.eos_token_id = None
+
+
+    @property
+    def vision_path(self):
+        return os.path.join(self.export_dir, "vision_encoder.onnx")
+
+
+    @property
+    def decoder_path(self):
+        return os.path.join(self.export_dir, "text_decoder.onnx")
+
+
+    def export(self, model):
+        """Exports the vision encoder and text decoder of a loaded model to ONNX."""
+        os.makedirs(self.export_dir, exist_ok=True)
+        image_size = model.config.vision_config.image_size
+
+        # Vision encoder: pixel values to patch embeddings
+        pixel_values = torch.zeros(1, 3, image_size, image_size)
+        torch.onnx.export(
+            model.vision_model, (pixel_values,), self.vision_path,
+            input_names=["pixel_values"], output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17,
+        )
+
+        # Text decoder: token ids and image embeddings to next-token logits
+        with torch.no_grad():
+            image_embeds = model.vision_model(pixel_values)[0]
+        input_ids = torch.tensor([[self.bos_token_id, self.eos_token_id]])
+        torch.onnx.export(
+            _text_decoder_wrapper(model.text_decoder), (input_ids, torch.ones_like(input_ids), image_embeds), self.decoder_path,
+            input_names=["input_ids", "attention_mask", "encoder_hidden_states"], output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "encoder_hidden_states": {0: "batch"},
+                "logits": {0: "batch", 1: "sequence"},
+            },
+            opset_version=17,
+        )
+
+
+    def load(self):
+        """Loads the processor and ONNX sessions, exporting the graphs on first use."""
+        import onnxruntime
+
+        import_ml()
+        self.processor = transformers.BlipProcessor.from_pretrained(self.model_name)
+        if not (os.path.exists(self.vision_path) and os.path.exists(self.decoder_path)):
+            model = transformers.BlipForConditionalGeneration.from_pretrained(self.model_name)
+            model.eval()
+            self.bos_token_id = model.config.text_config.bos_token_id
+            self.eos_token_id = model.config.text_config.sep_token_id
+            self.export(model)
+            del model
+        else:
+            config = transformers.BlipForConditionalGeneration.config_class.from_pretrained(self.model_name)
+            self.bos_token_id = config.text_config.bos_token_id
+            self.eos_token_id = config.text_config.sep_token_id
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        self.vision_session = onnxruntime.InferenceSession(self.vision_path, options, providers=providers)
+        self.decoder_session = onnxruntime.InferenceSession(self.decoder_path, options, providers=providers)
+
+
+    def _decode_tokens(self, raw_image, token_times=None, max_new_tokens=ONNX_MAX_LENGTH - 1, cancelled=None):
+        """Encodes the image once and yields greedily decoded token ids from the ONNX text decoder until done or cancelled."""
+        import numpy as np
+
+        with tracing.span("preprocess"):
+            pixel_values = self.processor(images=raw_image, return_tensors="np")["pixel_values"].astype(np.float32)
+        image_embeds = self.vision_session.run(None, {"pixel_values": pixel_values})[0]
+
+        input_ids = np.array([[self.bos_token_id]], dtype=np.int64)
+        for _ in range(max_new_tokens):
+            if cancelled is not None and cancelled.is_set():
+                break
+            logits = self.decoder_session.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": np.ones_like(input_ids),
+                "encoder_hidden_states": image_embeds,
+            })[0]
+            next_token = int(logits[0, -1].argmax())
+            if next_token == self.eos_token_id:
+                break
+            input_ids = np.concatenate([input_ids, [[next_token]]], axis=1)
+            if token_times is not None:
+                token_times.append(time.perf_counter())
+            yield next_token
+
+
+    @staticmethod
+    def _max_new_tokens(options):
+        return (options or {}).get("max_new_tokens", ONNX_MAX_LENGTH - 1)
+
+
+    def generate(self, raw_image, options=None, cancelled=None):
+        """Returns the greedily decoded caption for an RGB image."""
+        tokens = list(self._decode_tokens(raw_image, max_new_tokens=self._max_new_tokens(options), cancelled=cancelled))
+        self.last_token_count = len(tokens)
+        return self.processor.decode(tokens, skip_special_tokens=True)
+
+
+    def generate_batch(self, raw_images, options=None):
+        """Greedily decodes captions for a list of RGB images, running the encoder and each decoder step once per batch."""
+        import numpy as np
+
+        pixel_values = self.processor(images=raw_images, return_tensors="np")["pixel_values"].astype(np.float32)
+        image_embeds = self.vision_session.run(None, {"pixel_values": pixel_values})[0]
+
+        input_ids = np.full((len(raw_images), 1), self.bos_token_id, dtype=np.int64)
+        finished = np.zeros(len(raw_images), dtype=bool)
+        for _ in range(self._max_new_tokens(options)):
+            logits = self.decoder_session.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": np.ones_like(input_ids),
+                "encoder_hidden_states": image_embeds,
+            })[0]
+            # Rows that already ended keep receiving the end token, which decoding skips
+            next_tokens = np.where(finished, self.eos_token_id, logits[:, -1].argmax(axis=-1))
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+            input_ids = np.concatenate([input_ids, next_tokens[:, None]], axis=1)
+        return self.processor.batch_decode(input_ids[:, 1:].tolist(), skip_special_tokens=True)
+
+
+    def generate_stream(self, raw_image, token_times, options=None, cancelled=None):
+        """Yields caption text fragments (whole words) as the decoder produces them, appending token arrival times."""
+        tokens, emitted = [], 0
+        for token in self._decode_tokens(raw_image, token_times, self._max_new_tokens(options), cancelled):
+            tokens.append(token)
+            text = self.processor.decode(tokens, skip_special_tokens=True)
+            # Only emit up to the last space, since the final word may still be extended by subword tokens
+            boundary = text.rfind(" ") + 1
+            if boundary > emitted:
+                yield text[emitted:boundary]
+                emitted = boundary
+        text = self.processor.decode(tokens, skip_special_tokens=True)
+        if len(text) > emitted:
+            yield text[emitted:]
+
+
+
+# Available inference backends by name
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+
+class DecodeTimer:
+    """Running estimates of the fixed cost of a caption (preprocessing, image encoding) and of each decoded token."""
+
+    def __init__(self, smoothing=DECODE_TIME_SMOOTHING):
+        self.smoothing = smoothing
+        self.overhead = None        # Seconds before the first token
+        self.per_token = None       # Seconds per generated token
+
+
+    def _blend(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+
+    def observe(self, total_time, tokens, first_token_time=None):
+        """Updates the estimates from one caption; without a first-token time the overhead estimate is reused."""
+        if tokens <= 0:
+            return
+        if first_token_time is not None and tokens > 1:
+            self.overhead = self._blend(self.overhead, first_token_time)
+            self.per_token = self._blend(self.per_token, (total_time - first_token_time) / (tokens - 1))
+        else:
+            self.per_token = self._blend(self.per_token, max(0.0, total_time - (self.overhead or 0.0)) / tokens)
+
+
+    def max_tokens(self, deadline):
+        """Returns how many tokens fit in `deadline` seconds, or None before anything was measured."""
+        if self.per_token is None:
+            return None
+        return int(max(0.0, deadline - (self.overhead or 0.0)) / self.per_token) if self.per_token > 0 else None
+
+
+
+class CaptionStream:
+    """Iterates over the words of a caption as they are generated and records when each one arrived.
+
+    Once the optional `cancelled` event is set the backend stops decoding at
+    the next token and no further words are yielded.
+    """
+
+    def __init__(self, backend, raw_image, options=None, on_finish=None, cancelled=None, lock=None):
+        self._token_times = []      # perf_counter() of every generated token, filled in by the backend
+        self._trace = tracing.current()
+        self._trace_start = time.monotonic()
+        self._on_finish = on_finish # Called with the stream once the last word was produced (not when cancelled)
+        self._lock = lock or nullcontext()  # Held only while iterating, so a stream that is never iterated holds nothing
+        self._cancelled = cancelled
+        self._fragments = backend.generate_stream(raw_image, self._token_times, options, cancelled)
+        self.start_time = time.perf_counter()
+        self.word_times = []        # (word, seconds since generation started) in arrival order
+        self.total_time = None      # Seconds until the last word was produced
+        self.done = False
+
+
+    @property
+    def cancelled(self):
+        return self._cancelled is not None and self._cancelled.is_set()
+
+
+    def __iter__(self):
+        with self._lock:
+            # Time the generation from when the engine is free, not from when the stream was created
+            self.start_time = time.perf_counter()
+            self._trace_start = time.monotonic()
+            for fragment in self._fragments:
+                if self.cancelled:
+                    continue    # The backend stops at the next token; let it finish so the engine is free afterwards
+                now = time.perf_counter() - self.start_time
+                for word in fragment.split():
+                    self.word_times.append((word, now))
+                    yield word
+        self.total_time = time.perf_counter() - self.start_time
+        self.done = True
+        if self._on_finish is not None and not self.cancelled:
+            self._on_finish(self)
+        if self._trace is not None:
+            self._trace.add("generate", self._trace_start)
+            if self.word_times:
+                self._trace.add("first_word", self._trace_start, self._trace_start + self.word_times[0][1])
+
+
+    @property
+    def token_times(self):
+        """Seconds since generation started at which each token was produced."""
+        return [t - self.start_time for t in self._token_times]
+
+
+    @property
+    def text(self):
+        return " ".join(word for word, _ in self.word_times)
+
+
+    @property
+    def time_to_first_word(self):
+        return self.word_times[0][1] if self.word_times else None
+
+
+
+class CaptionEngine:
+    """Keeps a captioning backend resident so every caption reuses the loaded weights.
+
+    Captions are decoded with a named generation policy. With a deadline (in
+    seconds) the caption length is capped so that, judging by the recent decode
+    times of that policy, generation finishes within the deadline.
+    """
+
+    def __init__(self, backend=TorchBackend.name, model_name=MODEL_NAME, policy=DEFAULT_POLICY, deadline=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown caption backend '{backend}', expected one of {sorted(BACKENDS)}")
+        if policy not in GENERATION_POLICIES:
+            raise ValueError(f"Unknown generation policy '{policy}', expected one of {sorted(GENERATION_POLICIES)}")
+
+        self.policy = policy
+        self.deadline = deadline
+        self.decode_timers = {}         # Policy name -> DecodeTimer
+        self.last_generation = None     # Policy and settings used for the most recent caption
+        self.model_name = model_name
+        self.backend = BACKENDS[backend](model_name)
+        self.loaded = False
+        self._load_lock = Lock()
+        self._generate_lock = Lock()    # One caption at a time, so a new press waits for a cancelled one to stop
+        self.load_time = None           # Seconds spent loading the processor and model
+        self.warmup_time = None         # Seconds spent on the warm-up inference
+        self.last_inference_time = None # Seconds spent on the most recent caption
+        self.inference_count = 0
+        self.total_inference_time = 0.0
+
+
+    def load(self):
+        """Loads the backend once and runs a warm-up inference; concurrent callers wait for the same load."""
+        if self.loaded:
+            return self
+
+        with self._load_lock, tracing.span("model_load"):
+            if self.loaded:
+                return self
+
+            start_time = time.perf_counter()
+            self.backend.load()
+            self.load_time = time.perf_counter() - start_time
+
+            # Run one inference on a dummy image so the first real press does not pay for lazy initialisation
+            start_time = time.perf_counter()
+            self.backend.generate(Image.new("RGB", (384, 384)))
+            self.warmup_time = time.perf_counter() - start_time
+            self.loaded = True
+
+        print(f"Caption model ({self.backend.name}) loaded in {self.load_time:.2f}s (warm-up {self.warmup_time:.2f}s)")
+        return self
+
+
+    @property
+    def is_loaded(self):
+        return self.loaded
+
+
+    def generation_options(self, policy=None, deadline=None):
+        """Returns the generate options for a policy, capping max_new_tokens to meet the deadline if one is set.
+
+        Also records the choice in last_generation.
+        """
+        options, self.last_generation = self._generation_settings(policy, deadline)
+        return options
+
+
+    def _generation_settings(self, policy=None, deadline=None):
+        """Returns the generate options and the generation record (for last_generation) of a policy and deadline."""
+        policy = policy or self.policy
+        deadline = (deadline if deadline is not None else self.deadline) or None
+        options = dict(GENERATION_POLICIES[policy])
+
+        if deadline:
+            timer = self.decode_timers.setdefault(policy, DecodeTimer())
+            budget = timer.max_tokens(deadline)
+            if budget is not None:
+                options["max_new_tokens"] = max(MIN_DEADLINE_TOKENS, min(options["max_new_tokens"], budget))
+
+        generation = dict(
+            policy = policy,
+            deadline = deadline,
+            maxNewTokens = options["max_new_tokens"],
+            numBeams = options.get("num_beams", 1) if self.backend.name != OnnxBackend.name else 1,
+        )
+        return options, generation
+
+
+    def _observe(self, generation, total_time, tokens, first_token_time=None):
+        """Feeds a finished caption into the decode-time estimates of the policy it used."""
+        if tokens:
+            timer = self.decode_timers.setdefault(generation["policy"], DecodeTimer())
+            timer.observe(total_time, tokens, first_token_time)
+            generation.update(tokens=tokens, seconds=round(total_time, 3))
+
+
+    def caption(self, raw_image, policy=None, deadline=None, cancelled=None):
+        """Generates a caption for an RGB image, loading the model first if needed.
+
+        Once the optional `cancelled` event is set decoding stops at the next
+        token; the partial caption is returned but not counted in the statistics.
+        """
+        self.last_generation = None
+        self.load()
+        with self._generate_lock:
+            # The generation record is published in last_generation once the caption is complete
+            options, generation = self._generation_settings(policy, deadline)
+
+            start_time = time.perf_counter()
+            with tracing.span("generate"):
+                caption = self.backend.generate(raw_image, options, cancelled)
+            if cancelled is not None and cancelled.is_set():
+                return caption
+            self.last_inference_time = time.perf_counter() - start_time
+            self._observe(generation, self.last_inference_time, self.backend.last_token_count)
+            self.inference_count += 1
+            self.total_inference_time += self.last_inference_time
+            self.last_generation = generation
+
+        print(f"Caption generated in {self.last_inference_time:.2f}s")
+        return caption
+
+
+    def caption_batch(self, raw_images, policy=None):
+        """Generates captions for a list of RGB images in one batch, loading the model first if needed."""
+        self.load()
+        options = self.generation_options(policy, deadline=0)
+
+        start_time = time.perf_counter()
+        captions = self.backend.generate_batch(raw_images, options)
+        elapsed = time.perf_counter() - start_time
+
+        self.inference_count += len(raw_images)
+        self.total_inference_time += elapsed
+        return captions
+
+
+    def caption_stream(self, raw_image, policy=None, deadline=None, cancelled=None):
+        """Returns a CaptionStream yielding the caption word by word as the decoder produces it.
+
+        The engine is held while the stream is being iterated, one caption at a time.
+        """
+        self.last_generation = None
+        self.load()
+        # The generation record is published in last_generation once the caption is complete
+        options, generation = self._generation_settings(policy, deadline)
+
+        def on_finish(stream):
+            times = stream.token_times
+            self.last_inference_time = stream.total_time
+            if times:
+                self._observe(generation, times[-1], len(times), times[0])
+            else:
+                self._observe(generation, stream.total_time, self.backend.last_token_count)  # Beam search reports no per-token times
+            self.last_generation = generation
+
+        return CaptionStream(self.backend, raw_image, options, on_finish, cancelled, lock=self._generate_lock)
+
+
+    def stats(self):
+        """Returns load and inference timings collected so far."""
+        return dict(
+            backend = self.backend.name,
+            load_time = self.load_time,
+            warmup_time = self.warmup_time,
+            last_inference_time = self.last_inference_time,
+            inference_count = self.inference_count,
+            average_inference_time = self.total_inference_time / self.inference_count if self.inference_count else None,
+        )
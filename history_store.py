@@ -0,0 +1,258 @@
+# Standard library imports
+import os
+import json
+import sqlite3
+from threading import Lock
+
+
+# Setup base directory for file paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default database location and the legacy JSON history it replaces
+HISTORY_DB = os.path.join(base_dir, "data", "history.db")
+LEGACY_HISTORY_JSON = os.path.join(base_dir, "data", "history.json")
+
+# Upload states of a history record
+PENDING = 0
+UPLOADED = 1
+
+# Per-entry sync manifest columns added after the first release of the schema
+MANIFEST_COLUMNS = {
+    "metadata_uploaded": "INTEGER NOT NULL DEFAULT 0",     # Metadata POST confirmed by the server
+    "blob_uploaded": "INTEGER NOT NULL DEFAULT 0",         # Image blob upload confirmed by storage
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at  TEXT NOT NULL,
+    caption     TEXT NOT NULL,
+    filename    TEXT NOT NULL,
+    uploaded    INTEGER NOT NULL DEFAULT 0,
+    extra       TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key         TEXT PRIMARY KEY,
+    value       TEXT
+);
+CREATE INDEX IF NOT EXISTS history_created_at ON history (created_at);
+CREATE INDEX IF NOT EXISTS history_uploaded ON history (uploaded, created_at);
+"""
+
+
+
+class HistoryStore:
+    """Append-only interaction history in SQLite (WAL mode), shared by main.py and worker.py.
+
+    Records are returned as dicts in the shape of the old history.json entries
+    (createdAt, caption, filename) plus their id, upload status and any extra fields.
+    """
+
+    def __init__(self, path=HISTORY_DB, legacy_path=LEGACY_HISTORY_JSON):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+
+        # WAL lets the worker read while main appends; NORMAL sync keeps the database consistent across crashes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._import_legacy(legacy_path)
+
+
+    def _migrate(self):
+        """Adds sync manifest columns to databases created before they existed."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(history)")}
+        with self._conn:
+            for name, definition in MANIFEST_COLUMNS.items():
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE history ADD COLUMN {name} {definition}")
+
+
+    def _import_legacy(self, legacy_path):
+        """Moves records from the old history.json into the database once."""
+        if not legacy_path or not os.path.exists(legacy_path):
+            return
+
+        with open(legacy_path) as file:
+            try:
+                records = json.load(file)
+            except json.JSONDecodeError:
+                records = []
+
+        if records:
+            self.add_many(records)
+        os.replace(legacy_path, legacy_path + ".migrated")
+
+
+    @staticmethod
+    def _to_dict(row):
+        record = json.loads(row["extra"])
+        record.update(
+            id = row["id"],
+            createdAt = row["created_at"],
+            caption = row["caption"],
+            filename = row["filename"],
+            uploaded = bool(row["uploaded"]),
+            metadataUploaded = bool(row["metadata_uploaded"]),
+            blobUploaded = bool(row["blob_uploaded"]),
+        )
+        return record
+
+
+    @staticmethod
+    def _to_row(record):
+        extra = {k: v for k, v in record.items() if k not in ("id", "createdAt", "caption", "filename", "uploaded", "metadataUploaded", "blobUploaded")}
+        return (record["createdAt"], record["caption"], record["filename"], json.dumps(extra))
+
+
+    def add(self, created_at, caption, filename, **extra):
+        """Appends one interaction and returns its id."""
+        record = dict(extra, createdAt=created_at, caption=caption, filename=filename)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO history (created_at, caption, filename, extra) VALUES (?, ?, ?, ?)",
+                self._to_row(record),
+            )
+        return cursor.lastrowid
+
+
+    def add_many(self, records):
+        """Appends several records (dicts with createdAt, caption, filename) in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO history (created_at, caption, filename, extra) VALUES (?, ?, ?, ?)",
+                [self._to_row(record) for record in records],
+            )
+
+
+    def update_extra(self, record_id, **fields):
+        """Merges fields into the extra data of a record."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT extra FROM history WHERE id = ?", (record_id,)).fetchone()
+            if row is None:
+                return
+            extra = json.loads(row["extra"])
+            extra.update(fields)
+            self._conn.execute("UPDATE history SET extra = ? WHERE id = ?", (json.dumps(extra), record_id))
+
+
+    def update_captions(self, updates):
+        """Replaces the captions of several records in one transaction.
+
+        `updates` holds (record_id, caption, extra_fields) tuples; the fields are merged into the extra data.
+        """
+        with self._lock, self._conn:
+            for record_id, caption, fields in updates:
+                row = self._conn.execute("SELECT extra FROM history WHERE id = ?", (record_id,)).fetchone()
+                if row is None:
+                    continue
+                extra = json.loads(row["extra"])
+                extra.update(fields)
+                self._conn.execute(
+                    "UPDATE history SET caption = ?, extra = ? WHERE id = ?", (caption, json.dumps(extra), record_id)
+                )
+
+
+    def pending(self, limit=None):
+        """Returns records that have not been uploaded yet, oldest first."""
+        query = "SELECT * FROM history WHERE uploaded = ? ORDER BY created_at"
+        params = (PENDING,)
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            return [self._to_dict(row) for row in self._conn.execute(query, params)]
+
+
+    def pending_count(self):
+        """Returns how many records are waiting to be uploaded (answered from the upload-status index)."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history WHERE uploaded = ?", (PENDING,)).fetchone()[0]
+
+
+    def pending_due(self, now):
+        """Returns how many pending records are due for upload at `now` (a time.time() value) and the earliest later retryAt, or None.
+
+        retryAt is the per-entry upload backoff kept in the extra fields.
+        """
+        with self._lock:
+            due, next_retry = self._conn.execute(
+                "SELECT SUM(COALESCE(json_extract(extra, '$.retryAt'), 0) <= ?), "
+                "MIN(CASE WHEN json_extract(extra, '$.retryAt') > ? THEN json_extract(extra, '$.retryAt') END) "
+                "FROM history WHERE uploaded = ?",
+                (now, now, PENDING),
+            ).fetchone()
+        return due or 0, next_retry
+
+
+    def since(self, created_at):
+        """Returns records created at or after an ISO timestamp, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM history WHERE created_at >= ? ORDER BY created_at", (created_at,)
+            )
+            return [self._to_dict(row) for row in rows]
+
+
+    def by_filenames(self, filenames):
+        """Returns {filename: record} for the records of the given photo files."""
+        filenames = list(filenames)
+        records = {}
+        with self._lock:
+            # Query in chunks to stay under SQLite's limit on bound parameters
+            for i in range(0, len(filenames), 500):
+                chunk = filenames[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT * FROM history WHERE filename IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                records.update((row["filename"], self._to_dict(row)) for row in rows)
+        return records
+
+
+    def all(self):
+        """Returns every record, oldest first."""
+        with self._lock:
+            return [self._to_dict(row) for row in self._conn.execute("SELECT * FROM history ORDER BY created_at")]
+
+
+    def mark_uploaded(self, record_ids):
+        """Flags records as uploaded."""
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE history SET uploaded = ? WHERE id = ?", [(UPLOADED, i) for i in record_ids])
+
+
+    def mark_metadata_uploaded(self, record_id):
+        """Records that the server confirmed the metadata of an entry."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE history SET metadata_uploaded = 1 WHERE id = ?", (record_id,))
+
+
+    def mark_blob_uploaded(self, record_id):
+        """Records that blob storage confirmed the image of an entry."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE history SET blob_uploaded = 1 WHERE id = ?", (record_id,))
+
+
+    def get_state(self, key, default=None):
+        """Reads a value from the sync state (e.g. the staged blocks of an interrupted upload)."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row["value"]
+
+
+    def set_state(self, key, value):
+        """Stores a value in the sync state (None removes the key)."""
+        with self._lock, self._conn:
+            if value is None:
+                self._conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+            else:
+                self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
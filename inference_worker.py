@@ -0,0 +1,440 @@
+# Standard library imports
+import os
+import sys
+import time
+import socket
+import argparse
+import itertools
+import subprocess
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+
+# Third-party imports
+import numpy as np
+
+# Local imports
+import tracing
+from caption_engine import MODEL_NAME, DEFAULT_POLICY
+
+
+# Setup base directory for file paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Largest frame that can be handed over (a full-resolution RGB capture)
+FRAME_BUFFER_BYTES = 1920 * 1080 * 3
+
+# Seconds without any reply (word or result) after which the inference process counts as hung and is restarted
+REQUEST_TIMEOUT = 30
+
+# Seconds to wait for the model to load in a (re)started process
+LOAD_TIMEOUT = 300
+
+# Delay before restarting a process that exited before its model loaded, doubled after each such exit
+RESTART_DELAY = 1
+RESTART_DELAY_MAX = 60
+
+# Seconds between checks of a request's cancelled event while waiting for a reply
+CANCEL_POLL_INTERVAL = 0.1
+
+# Scheduling priority of the inference process relative to the UI process (higher is nicer)
+INFERENCE_NICENESS = 5
+
+# Spans the caller times itself (including the hand-over), so the inference process's own are not added to its trace
+CALLER_SPANS = ("generate", "first_word")
+
+
+
+def _add_spans(trace, spans):
+    """Adds the spans recorded in the inference process to a trace of this process.
+
+    Both processes take their timestamps from the system-wide monotonic clock,
+    so the spans line up with the caller's own.
+    """
+    if trace is None:
+        return
+    for name, start, end in spans:
+        if name not in CALLER_SPANS:
+            trace.add(name, start, end)
+
+
+
+class RemoteCaptionStream:
+    """Iterates over the caption words streamed back by the inference process, like CaptionStream.
+
+    The request is only sent when iteration starts, so a stream that is never
+    iterated does not hold the inference process.
+    """
+
+    def __init__(self, client, raw_image, policy=None, deadline=None, cancelled=None):
+        self._client = client
+        self._request = (raw_image, True, policy, deadline)
+        self._cancelled = cancelled
+        self._trace = tracing.current()
+        self._trace_start = time.monotonic()
+        self.start_time = time.perf_counter()
+        self.word_times = []        # (word, seconds since the request was sent) in arrival order
+        self._token_times = []      # perf_counter() of every generated token, reported by the inference process with the result
+        self.total_time = None
+        self.done = False
+
+
+    @property
+    def cancelled(self):
+        return self._cancelled is not None and self._cancelled.is_set()
+
+
+    def __iter__(self):
+        request_id, replies = self._client._submit(*self._request)
+        self._request = None
+        self.start_time = time.perf_counter()
+        self._trace_start = time.monotonic()
+        finished = False
+        try:
+            while True:
+                reply = self._client._reply(replies, request_id, self._cancelled)
+                if reply[0] == "word":
+                    if not self.cancelled:
+                        self.word_times.append((reply[2], time.perf_counter() - self.start_time))
+                        yield reply[2]
+                    continue
+                if not self.cancelled:
+                    self._client.last_generation = reply[4]
+                _add_spans(self._trace, reply[5])
+                self._token_times = reply[6]
+                finished = True
+                break
+        finally:
+            if not finished:
+                # Abandoned before the result: stop the generation so the next request does not queue behind it
+                self._client._cancel(request_id)
+            self._client._finish(request_id)
+
+        self.total_time = time.perf_counter() - self.start_time
+        self.done = True
+        if self._trace is not None:
+            self._trace.add("generate", self._trace_start)
+            if self.word_times:
+                self._trace.add("first_word", self._trace_start, self._trace_start + self.word_times[0][1])
+
+
+    @property
+    def token_times(self):
+        """Seconds since the request was sent at which each token was produced."""
+        return [t - self.start_time for t in self._token_times]
+
+
+    @property
+    def text(self):
+        return " ".join(word for word, _ in self.word_times)
+
+
+    @property
+    def time_to_first_word(self):
+        return self.word_times[0][1] if self.word_times else None
+
+
+
+class InferenceProcess:
+    """Runs the CaptionEngine in a separate process so inference never holds the UI process's GIL.
+
+    Frames are copied into a shared memory block and only small request and
+    reply tuples cross the socket. A process that exits or stops replying is
+    restarted automatically, and the request in flight fails with an error.
+    The interface matches CaptionEngine (load, is_loaded, caption, caption_stream, last_generation).
+    """
+
+    def __init__(self, backend="pytorch", model_name=MODEL_NAME, policy=DEFAULT_POLICY, deadline=None,
+                 frame_bytes=FRAME_BUFFER_BYTES, request_timeout=REQUEST_TIMEOUT, load_timeout=LOAD_TIMEOUT):
+        self.backend = backend
+        self.model_name = model_name
+        self.policy = policy
+        self.deadline = deadline
+        self.request_timeout = request_timeout
+        self.load_timeout = load_timeout
+        self.last_generation = None
+        self.load_time = None           # Seconds the most recent process took to load the model
+        self.restarts = 0
+        self._failed_starts = 0         # Consecutive processes that exited before becoming ready
+        self._frames = shared_memory.SharedMemory(create=True, size=frame_bytes)
+        self._request_lock = Lock()     # One request in flight; the shared frame buffer is reused
+        self._ready = Event()
+        self._replies = {}              # Request id -> Queue of replies
+        self._ids = itertools.count()
+        self._process = None
+        self._conn = None
+        self._state_lock = Lock()
+        self._load_lock = Lock()        # Serializes the first start between the background loader and a press
+        self._stopping = False
+
+
+    def _start(self):
+        """Launches a fresh inference process and the thread that reads its replies."""
+        parent_socket, child_socket = socket.socketpair()
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            "--fd", str(child_socket.fileno()),
+            "--frames", self._frames.name,
+            "--backend", self.backend,
+            "--model", self.model_name,
+            "--policy", self.policy,
+        ]
+        if self.deadline:
+            command += ["--deadline", str(self.deadline)]
+
+        # The process logs to stderr, so its messages never mix into output written to stdout (e.g. a benchmark's JSON report)
+        process = subprocess.Popen(command, pass_fds=(child_socket.fileno(),), cwd=base_dir, stdout=sys.stderr)
+        child_socket.close()
+        conn = Connection(parent_socket.detach())
+        with self._state_lock:
+            self._process, self._conn = process, conn
+        Thread(target=self._read, args=(process, conn), daemon=True).start()
+
+
+    def _read(self, process, conn):
+        """Routes replies to waiting requests; when the process ends, fails them and starts a new one."""
+        loaded = False
+        while True:
+            try:
+                if not conn.poll(0.5):
+                    if process.poll() is None:
+                        continue
+                    break
+                reply = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if reply[0] == "ready":
+                self.load_time = reply[1]
+                self._failed_starts = 0
+                loaded = True
+                self._ready.set()
+                continue
+            replies = self._replies.get(reply[1])
+            if replies is not None:
+                replies.put(reply)
+
+        # The process exited (or was killed because it hung)
+        self._ready.clear()
+        process.kill()
+        process.wait()
+        conn.close()
+        for replies in list(self._replies.values()):
+            replies.put(("error", None, f"Inference process exited with code {process.returncode}"))
+        with self._state_lock:
+            if self._stopping:
+                return
+        self.restarts += 1
+        delay = 0
+        if not loaded:
+            # Back off when the model keeps failing to load instead of restarting in a tight loop
+            delay = min(RESTART_DELAY_MAX, RESTART_DELAY * 2 ** self._failed_starts)
+            self._failed_starts += 1
+        print(f"Inference process exited with code {process.returncode}, restarting in {delay}s")
+        time.sleep(delay)
+        self._start()
+
+
+    def load(self):
+        """Starts the inference process if needed and waits until its model has loaded."""
+        with self._load_lock:
+            if self._process is None:
+                self._start()
+        if self._ready.is_set():
+            return self
+        # The model loads in the inference process; the caller's trace gets the time spent waiting for it
+        with tracing.span("model_load"):
+            if not self._ready.wait(self.load_timeout):
+                raise TimeoutError("The inference process did not finish loading the model")
+        return self
+
+
+    @property
+    def is_loaded(self):
+        return self._ready.is_set()
+
+
+    def _submit(self, frame, stream, policy, deadline):
+        """Copies the frame into shared memory and sends the request; returns (request id, reply queue)."""
+        if not isinstance(frame, np.ndarray):
+            frame = np.asarray(frame.convert("RGB"))
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.nbytes > self._frames.size:
+            raise ValueError(f"Frame of {frame.nbytes} bytes exceeds the {self._frames.size} byte shared buffer")
+
+        self.load()
+        self._request_lock.acquire()
+        try:
+            np.ndarray(frame.shape, dtype=np.uint8, buffer=self._frames.buf)[...] = frame
+            request_id = next(self._ids)
+            replies = self._replies[request_id] = Queue()
+            self._conn.send((request_id, frame.shape, stream, policy, deadline))
+        except Exception:
+            self._finish(None)
+            raise
+        return request_id, replies
+
+
+    def _cancel(self, request_id):
+        """Asks the inference process to stop generating for a request."""
+        try:
+            self._conn.send(("cancel", request_id))
+        except (OSError, ValueError):
+            pass    # The process is gone, so the request has ended anyway
+
+
+    def _reply(self, replies, request_id=None, cancelled=None):
+        """Waits for the next reply, restarting the process if it does not answer in time.
+
+        Once the optional `cancelled` event is set the process is asked to stop
+        the request, which it answers with its (partial) result.
+        """
+        deadline = time.monotonic() + self.request_timeout
+        cancel_sent = False
+        while True:
+            if cancelled is not None and cancelled.is_set() and not cancel_sent:
+                self._cancel(request_id)
+                cancel_sent = True
+            timeout = deadline - time.monotonic()
+            if cancelled is not None and not cancel_sent:
+                timeout = min(timeout, CANCEL_POLL_INTERVAL)
+            try:
+                reply = replies.get(timeout=max(0, timeout))
+                break
+            except Empty:
+                if time.monotonic() < deadline:
+                    continue
+            with self._state_lock:
+                process = self._process
+            # Hold new requests until the reader thread has noticed the exit and the new process is ready
+            self._ready.clear()
+            process.kill()
+            raise TimeoutError("The inference process stopped responding")
+        if reply[0] == "error":
+            raise RuntimeError(reply[2])
+        return reply
+
+
+    def _finish(self, request_id):
+        self._replies.pop(request_id, None)
+        self._request_lock.release()
+
+
+    def caption(self, raw_image, policy=None, deadline=None, cancelled=None):
+        """Generates a caption for an RGB frame (array or PIL image) in the inference process.
+
+        Once the optional `cancelled` event is set the process stops decoding and the partial caption is returned.
+        """
+        self.last_generation = None
+        with tracing.span("generate"):
+            request_id, replies = self._submit(raw_image, False, policy, deadline)
+            try:
+                reply = self._reply(replies, request_id, cancelled)
+            finally:
+                self._finish(request_id)
+        _add_spans(tracing.current(), reply[5])
+        self.last_generation = reply[4]
+        return reply[2]
+
+
+    def caption_stream(self, raw_image, policy=None, deadline=None, cancelled=None):
+        """Returns a stream yielding the caption word by word as the inference process produces it."""
+        self.last_generation = None
+        return RemoteCaptionStream(self, raw_image, policy, deadline, cancelled)
+
+
+    def stop(self):
+        """Ends the inference process and releases the shared frame buffer."""
+        with self._state_lock:
+            self._stopping = True
+            process, conn = self._process, self._conn
+        if process is not None:
+            try:
+                conn.send(None)
+                process.wait(timeout=5)
+            except Exception:
+                process.kill()
+        self._frames.close()
+        self._frames.unlink()
+
+
+
+def serve(conn, frames_name, backend, model_name, policy, deadline):
+    """Inference process: loads the model, then captions the frames it is sent until told to stop."""
+    from caption_engine import CaptionEngine
+
+    os.nice(INFERENCE_NICENESS)
+    frames = shared_memory.SharedMemory(name=frames_name)
+    # The UI process owns the block; keep this process's resource tracker from unlinking it on exit
+    resource_tracker.unregister(frames._name, "shared_memory")
+
+    engine = CaptionEngine(backend=backend, model_name=model_name, policy=policy, deadline=deadline).load()
+    conn.send(("ready", engine.load_time))
+
+    # A reader thread takes requests off the socket so cancel messages arrive while a caption is being generated
+    requests, cancels = Queue(), {}
+
+    def receive():
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                message = None
+            if message is None:
+                requests.put(None)
+                return
+            if message[0] == "cancel":
+                # Requests arrive before their cancel message; one that already finished has no entry left
+                if message[1] in cancels:
+                    cancels[message[1]].set()
+                continue
+            cancels[message[0]] = Event()
+            requests.put(message)
+
+    Thread(target=receive, daemon=True).start()
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, shape, stream, policy, deadline = request
+        cancelled = cancels[request_id]
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=frames.buf).copy()
+        # Spans of this request (e.g. preprocess) go back with the result, to be added to the caller's trace
+        trace = tracing.tracer.begin("inference")
+        try:
+            if cancelled.is_set():
+                # Cancelled while queued behind another caption
+                conn.send(("done", request_id, "", 0.0, None, [], []))
+            elif stream:
+                caption_stream = engine.caption_stream(frame, policy, deadline, cancelled)
+                for word in caption_stream:
+                    conn.send(("word", request_id, word))
+                generation = None if cancelled.is_set() else engine.last_generation
+                conn.send(("done", request_id, caption_stream.text, caption_stream.total_time, generation,
+                           trace.export(), [caption_stream.start_time + t for t in caption_stream.token_times]))
+            else:
+                caption = engine.caption(frame, policy, deadline, cancelled)
+                generation = None if cancelled.is_set() else engine.last_generation
+                conn.send(("done", request_id, caption, engine.last_inference_time, generation, trace.export(), []))
+        except Exception as e:
+            conn.send(("error", request_id, f"{type(e).__name__}: {e}"))
+        finally:
+            cancels.pop(request_id, None)
+
+    frames.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Captioning process started by InferenceProcess.")
+    parser.add_argument("--fd", type=int, required=True, help="Socket connected to the UI process")
+    parser.add_argument("--frames", required=True, help="Name of the shared frame buffer")
+    parser.add_argument("--backend", default="pytorch")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--policy", default=DEFAULT_POLICY)
+    parser.add_argument("--deadline", type=float, default=None)
+    args = parser.parse_args()
+
+    serve(Connection(args.fd), args.frames, args.backend, args.model, args.policy, args.deadline)
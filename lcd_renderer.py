@@ -0,0 +1,201 @@
+# Standard library imports
+import time
+import textwrap
+from threading import Condition, Thread
+from collections import deque
+
+
+# Default display geometry and timing
+LCD_COLUMNS = 16
+LCD_ROWS = 2
+SCROLL_INTERVAL = 1.0   # Seconds each pair of lines stays on screen while scrolling
+END_HOLD = 1.5          # Seconds the last lines stay on screen before the scroll wraps around
+
+# Finished messages whose write counts are kept (streamed captions finish one message per word)
+MESSAGE_HISTORY = 256
+
+
+
+def layout(text, columns=LCD_COLUMNS):
+    """Word-wraps text into display lines of at most `columns` characters."""
+    lines = textwrap.wrap(text.strip(), columns, break_long_words=True) or [""]
+    return [line.ljust(columns) for line in lines]
+
+
+
+class LCDRenderer:
+    """Framebuffer-based LCD renderer running on its own thread.
+
+    show() returns immediately; the renderer thread diffs each new frame
+    against what is on the display and only writes the cells that changed.
+    Text longer than the display scrolls line by line over both rows.
+    """
+
+    def __init__(self, lcd, columns=LCD_COLUMNS, rows=LCD_ROWS, scroll_interval=SCROLL_INTERVAL):
+        self.lcd = lcd
+        self.columns = columns
+        self.rows = rows
+        self.scroll_interval = scroll_interval
+        self.framebuffer = [" " * columns for _ in range(rows)]    # What the display currently shows
+        self.writes = 0                 # Commands and characters sent to the display for the current message
+        self.writes_per_message = deque(maxlen=MESSAGE_HISTORY)    # (text, writes) of the most recent finished messages
+        self.total_writes = 0           # Writes of all finished messages
+        self._lines = None              # Lines of the message being shown
+        self._text = ""
+        self._offset = 0                # First line currently on screen
+        self._loop = True               # Wrap around to the start after the last lines
+        self._next_step = None          # When the next scroll step is due
+        self._shown_at = 0.0            # When the current message was first shown
+        self._changed = False
+        self._running = True
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+        self.lcd.clear()
+        self._thread.start()
+        return self
+
+
+    def show(self, text, anchor_end=False, loop=True):
+        """Replaces the message on screen without blocking, cancelling any scroll in progress.
+
+        With anchor_end the last lines are shown and nothing scrolls (used for text that is still growing).
+        """
+        lines = layout(text, self.columns)
+        with self._condition:
+            if self._lines is not None:
+                self.writes_per_message.append((self._text, self.writes))
+                self.total_writes += self.writes
+            self.writes = 0
+            if text != self._text:
+                self._shown_at = time.monotonic()
+            self._text = text
+            self._lines = lines
+            self._loop = loop
+            self._offset = max(0, len(lines) - self.rows) if anchor_end else 0
+            self._next_step = None if anchor_end or len(lines) <= self.rows else time.monotonic() + self.scroll_interval
+            self._changed = True
+            self._condition.notify()
+
+
+    def clear(self):
+        self.show("", loop=False)
+
+
+    def _frame(self):
+        """Builds the rows to display for the current scroll offset."""
+        lines = self._lines[self._offset:self._offset + self.rows]
+        return lines + [" " * self.columns] * (self.rows - len(lines))
+
+
+    def _flush(self, frame):
+        """Writes only the runs of cells that differ from the framebuffer."""
+        for row, (old, new) in enumerate(zip(self.framebuffer, frame)):
+            col = 0
+            while col < self.columns:
+                if old[col] == new[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < self.columns and old[col] != new[col]:
+                    col += 1
+                self.lcd.cursor_position(start, row)
+                self.lcd.message = new[start:col]
+                self.writes += 2 + (col - start)    # Our cursor command, the driver's own cursor command, then one write per character
+            self.framebuffer[row] = new
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._changed:
+                    timeout = None if self._next_step is None else max(0.0, self._next_step - time.monotonic())
+                    if timeout == 0.0:
+                        break
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+
+                if not self._changed and self._next_step is not None:
+                    # Advance the scroll by one line, holding the last lines a little longer before wrapping
+                    last_offset = len(self._lines) - self.rows
+                    if self._offset >= last_offset:
+                        self._offset = 0
+                        self._next_step = time.monotonic() + self.scroll_interval if self._loop else None
+                    else:
+                        self._offset += 1
+                        hold = END_HOLD if self._offset >= last_offset else self.scroll_interval
+                        self._next_step = time.monotonic() + hold
+                self._changed = False
+                frame = self._frame()
+
+            # Write outside the lock so show() never waits on the display
+            self._flush(frame)
+
+
+    def wait_idle(self, timeout=None, hold=0):
+        """Blocks until the current message has scrolled through once and been visible for `hold` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                scrolling = self._next_step is not None and self._offset < len(self._lines) - self.rows
+                scrolling = scrolling or time.monotonic() < self._shown_at + hold
+            if not scrolling or (deadline is not None and time.monotonic() >= deadline):
+                return
+            time.sleep(0.05)
+
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join(timeout=1)
+
+
+
+class SimulatedLCD:
+    """In-memory stand-in for Character_LCD_Mono that counts the writes it receives."""
+
+    def __init__(self, columns=LCD_COLUMNS, rows=LCD_ROWS):
+        self.columns = columns
+        self.rows = rows
+        self.cells = [[" "] * columns for _ in range(rows)]
+        self.column = 0
+        self.row = 0
+        self.writes = 0
+
+
+    def clear(self):
+        self.cells = [[" "] * self.columns for _ in range(self.rows)]
+        self.column = self.row = 0
+        self.writes += 1
+
+
+    def cursor_position(self, column, row):
+        self.column, self.row = column, row
+        self.writes += 1
+
+
+    @property
+    def message(self):
+        return "\n".join("".join(row) for row in self.cells)
+
+
+    @message.setter
+    def message(self, text):
+        # Like the real driver, writing starts at the cursor and "\n" moves to the next row
+        self.writes += 1    # The driver re-sends the cursor position before the first character
+        for character in text:
+            if character == "\n":
+                self.row, self.column = min(self.row + 1, self.rows - 1), 0
+                continue
+            if self.column < self.columns:
+                self.cells[self.row][self.column] = character
+            self.column += 1
+            self.writes += 1
+
+
+    def __str__(self):
+        return self.message
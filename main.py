@@ -1,28 +1,51 @@
 # Standard library imports
 import os
 import time
-import json
+import asyncio
 from datetime import datetime
-from threading import Thread
+from queue import Queue
+from threading import Event, Thread
 from subprocess import PIPE
 
+# Reference point for the startup timings (time-to-ready and time-to-model-ready)
+STARTED_AT = time.monotonic()
+
+# Run against simulated camera, button, LCD and audio instead of the Pi peripherals (SIMULATE_HARDWARE=1)
+SIMULATE_HARDWARE = os.getenv("SIMULATE_HARDWARE", "0") == "1"
+
 # External library imports for Raspberry Pi hardware control
-import board
-import digitalio
-import RPi.GPIO as GPIO
-import adafruit_character_lcd.character_lcd as characterlcd
+if not SIMULATE_HARDWARE:
+    import board
+    import digitalio
+    import RPi.GPIO as GPIO
+    import adafruit_character_lcd.character_lcd as characterlcd
+from button_input import GPIOButtonSource, SimulatedButtonSource, SHORT_PRESS
+from lcd_renderer import LCDRenderer, SimulatedLCD
 
 # Imports for camera and image processing
-from picamera2 import Picamera2
-from picamera2.encoders import JpegEncoder
+if not SIMULATE_HARDWARE:
+    from picamera2 import Picamera2
+from camera_manager import CameraManager, SimulatedPicamera2, yuv420_to_rgb
 from PIL import Image
 
 # Imports for sound and voice synthesis
-from gtts import gTTS
-import pygame
+from audio_engine import AudioEngine
+from speech import TextToSpeech, StreamingSpeaker, AudioCache, CACHE_DIR
 
 # Imports for machine learning and model processing
-from transformers import BlipProcessor, BlipForConditionalGeneration
+from caption_engine import CaptionEngine
+from caption_cache import CachedCaptioner
+from inference_worker import InferenceProcess
+
+# Interaction history storage
+from history_store import HistoryStore, HISTORY_DB
+from photo_store import PhotoStore, PHOTO_DIR
+
+# Press pipeline orchestration
+from pipeline import PipelineRunner
+
+# Per-stage latency tracing
+import tracing
 
 # Module for handling warnings
 import warnings
@@ -41,156 +64,328 @@ warnings.filterwarnings("ignore")
 # Constants for GPIO
 BUTTON_PIN = 16
 SHORT_PRESS_TIME = 0.5  # Duration for identifying a short press in seconds (500 milliseconds)
-DEBOUNCE_TIME = 0.1     # Time to ignore further changes to avoid bouncing in seconds (100 milliseconds)
+BOUNCE_TIME_MS = 50     # Edges closer together than this are ignored as contact bounce (50 milliseconds)
+
+# Pass captured frames to the captioner in memory instead of round-tripping through a PNG on disk
+CAPTURE_TO_MEMORY = True
+
+# Size of the low-resolution stream the ISP scales down for the captioning model
+MODEL_INPUT_SIZE = (384, 384)
+
+# Keep the full-resolution main frame for the archived photo (otherwise the model-sized frame is archived)
+ARCHIVE_FULL_RESOLUTION = True
+
+# Archived photos are JPEG-encoded in the background, optionally downscaled, and kept under a disk quota
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", 90))
+PHOTO_MAX_DIMENSION = int(os.getenv("PHOTO_MAX_DIMENSION", 0)) or None    # Longest side in pixels, 0 keeps full resolution
+PHOTO_QUOTA_MB = int(os.getenv("PHOTO_QUOTA_MB", 2048))
+
+# Seconds the camera keeps streaming after the last capture before the sensor is powered down
+CAMERA_IDLE_TIMEOUT = 30
+
+# Speech engine ("espeak" works offline, "gtts" needs an internet connection)
+TTS_ENGINE = os.getenv("TTS_ENGINE", "espeak")
+
+# Announced instead of a caption when the image cannot be captioned
+ERROR_MESSAGE = "Error processing the image."
+
+# Fixed prompts synthesized at startup so they play instantly
+FIXED_PROMPTS = ["Processing image...", ERROR_MESSAGE, "Still starting up, one moment..."]
+
+# Speak and display caption words as the decoder produces them instead of waiting for the full caption
+STREAM_CAPTIONS = True
+
+# Minimum seconds a caption stays on the LCD before "Ready..." replaces it
+CAPTION_HOLD_TIME = 2
+
+# Inference backend used for captioning ("pytorch", "int8" or "onnx")
+CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", "pytorch")
+
+# Decoding strategy ("fast", "balanced" or "quality") and optional target seconds per caption (deadline mode)
+CAPTION_POLICY = os.getenv("CAPTION_POLICY", "balanced")
+CAPTION_DEADLINE = float(os.getenv("CAPTION_DEADLINE", 0)) or None
+
+# Run captioning in a separate process so inference never stalls the LCD, audio and button threads
+INFERENCE_PROCESS = os.getenv("INFERENCE_PROCESS", "1") == "1"
+
+# Answer presses at an unchanged scene from recently generated captions instead of re-running the model
+CAPTION_CACHE = os.getenv("CAPTION_CACHE", "1") == "1"
+
+# Run each press as an asyncio pipeline that overlaps feedback with inference and can be cancelled by the next press
+# (ASYNC_PIPELINE=0 runs the stages one after another as before)
+ASYNC_PIPELINE = os.getenv("ASYNC_PIPELINE", "1") == "1"
 
 # Setup base directory for file paths
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
+# Images the simulated camera serves in turn (required with SIMULATE_HARDWARE=1)
+SIMULATED_IMAGE_DIR = os.getenv("SIMULATED_IMAGE_DIR")
+if SIMULATE_HARDWARE and not SIMULATED_IMAGE_DIR:
+    raise SystemExit("SIMULATE_HARDWARE=1 needs SIMULATED_IMAGE_DIR set to a directory of sample images")
+
+# Where photos and synthesized speech are stored (redirected by the pipeline benchmark)
+PHOTO_DIR = os.getenv("PHOTO_DIR", PHOTO_DIR)
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", CACHE_DIR)
+
 # Sound files for camera and system sounds
 sounds = dict(
     start = os.path.join(base_dir, "sounds", "pi-start.mp3"),
     camera = os.path.join(base_dir, "sounds", "camera-shutter.mp3"),
 )
 
-# GPIO setup for button input
-GPIO.setmode(GPIO.BCM)  # Set GPIO pin numbering
-GPIO.setup(BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)  # Configure button pin with pull-up resistor
+# Edge-triggered button input; presses are queued as events by the GPIO interrupt callback
+if SIMULATE_HARDWARE:
+    button = SimulatedButtonSource(short_press_time=SHORT_PRESS_TIME)
+else:
+    button = GPIOButtonSource(BUTTON_PIN, bounce_time_ms=BOUNCE_TIME_MS, short_press_time=SHORT_PRESS_TIME)
 
 # Create and configure the camera
-picam2 = Picamera2()
-picam2.configure(picam2.create_preview_configuration(main={"size": (1920, 1080)}))  # Set camera resolution
+picam2 = SimulatedPicamera2(SIMULATED_IMAGE_DIR) if SIMULATE_HARDWARE else Picamera2()
+picam2.configure(picam2.create_preview_configuration(
+    main={"size": (1920, 1080), "format": "XBGR8888"},     # Full-resolution RGBX frame for archiving
+    lores={"size": MODEL_INPUT_SIZE, "format": "YUV420"},   # Model-sized frame for captioning
+))
+camera = CameraManager(picam2, idle_timeout=CAMERA_IDLE_TIMEOUT)  # Keep the camera warm between presses
 
 # LCD screen setup parameters
 lcd_columns = 16  # Number of columns in the LCD display
 lcd_rows = 2      # Number of rows in the LCD display
 
-# Pins setup for the LCD on Raspberry Pi
-lcd_rs = digitalio.DigitalInOut(board.D25)
-lcd_en = digitalio.DigitalInOut(board.D24)
-lcd_d4 = digitalio.DigitalInOut(board.D23)
-lcd_d5 = digitalio.DigitalInOut(board.D17)
-lcd_d6 = digitalio.DigitalInOut(board.D18)
-lcd_d7 = digitalio.DigitalInOut(board.D22)
-
-# Initialize the LCD display
-lcd = characterlcd.Character_LCD_Mono(
-    lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6, lcd_d7, lcd_columns, lcd_rows
-)
+if SIMULATE_HARDWARE:
+    lcd = SimulatedLCD(lcd_columns, lcd_rows)
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")   # Mix audio without a sound card
+else:
+    # Pins setup for the LCD on Raspberry Pi
+    lcd_rs = digitalio.DigitalInOut(board.D25)
+    lcd_en = digitalio.DigitalInOut(board.D24)
+    lcd_d4 = digitalio.DigitalInOut(board.D23)
+    lcd_d5 = digitalio.DigitalInOut(board.D17)
+    lcd_d6 = digitalio.DigitalInOut(board.D18)
+    lcd_d7 = digitalio.DigitalInOut(board.D22)
+
+    # Initialize the LCD display
+    lcd = characterlcd.Character_LCD_Mono(
+        lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6, lcd_d7, lcd_columns, lcd_rows
+    )
+
+# Non-blocking renderer that only sends the cells that changed
+lcd_renderer = LCDRenderer(lcd, lcd_columns, lcd_rows)
 
-# Variables to track the state of the button
-prev_button_state = GPIO.LOW  # Previous state from the input pin
-button_state = None           # Current reading from the input pin
-press_time_start = 0          # Start time of a button press
-press_time_end = 0            # End time of a button press
+# Audio thread owning the mixer, with the system sounds decoded in memory
+audio = AudioEngine(sounds)
 
+# Speech synthesis with a persistent cache of synthesized audio
+tts = TextToSpeech(backend=TTS_ENGINE, cache=AudioCache(TTS_CACHE_DIR))
 
+# Plays long texts phrase by phrase while the next phrase is synthesized
+speaker = StreamingSpeaker(tts, audio)
 
+# Event loop and reused thread pool that run the press pipelines
+runner = PipelineRunner()
+
+# Append-only interaction history shared with worker.py
+history = HistoryStore(os.getenv("HISTORY_DB", HISTORY_DB))
+
+# Bounded store for the archived photos, evicting uploaded photos first when the quota is exceeded
+photo_store = PhotoStore(history, directory=PHOTO_DIR, quality=PHOTO_JPEG_QUALITY, max_dimension=PHOTO_MAX_DIMENSION,
+                         quota_bytes=PHOTO_QUOTA_MB * 1024 * 1024)
+
+# Captioning engine, loaded in the background after startup and reused for every press
+if INFERENCE_PROCESS:
+    caption_engine = InferenceProcess(backend=CAPTION_BACKEND, policy=CAPTION_POLICY, deadline=CAPTION_DEADLINE)
+else:
+    caption_engine = CaptionEngine(backend=CAPTION_BACKEND, policy=CAPTION_POLICY, deadline=CAPTION_DEADLINE)
+if CAPTION_CACHE:
+    caption_engine = CachedCaptioner(caption_engine)    # Perceptual-hash cache in front of the engine
+
+# Seconds from process start until "Ready..." was announced and until the model finished loading
+startup_times = dict(ready=None, model_ready=None)
+
+
+
+
+
+
+
+def save_frame(frame, filename):
+    """Queues an in-memory RGB frame for JPEG encoding into the photo store without blocking."""
+    trace, start = tracing.current(), time.monotonic()
+    future = photo_store.save(frame, filename)
+    if trace is not None:
+        future.add_done_callback(lambda _: trace.add("archive_save", start))
 
 
 
 def capture_image(filename):
-    """Captures an image from the connected camera and saves it as a file."""
-    # Start the camera
-    picam2.start()
-    
-    # Allow some time for the camera to adjust settings
-    time.sleep(1)  # Sleep for 1 second
+    """Captures an image from the connected camera.
+
+    With CAPTURE_TO_MEMORY the model-sized lores frame is returned as an RGB array
+    and the archival copy is encoded to the file by the photo store's background thread;
+    otherwise the full-resolution image is saved as a file as before.
+    """
+    if CAPTURE_TO_MEMORY:
+        # Grab the model-sized frame (and the full-resolution one only when it is archived) from the warm camera
+        streams = ("lores", "main") if ARCHIVE_FULL_RESOLUTION else ("lores",)
+        with tracing.span("capture"):
+            frames = camera.capture_arrays(streams)
+            frame = yuv420_to_rgb(frames["lores"])
+        archive_frame = frames["main"][:, :, :3] if ARCHIVE_FULL_RESOLUTION else frame
+        
+        # Write the archival copy off the critical path
+        save_frame(archive_frame, filename)
+        return frame
     
     # Capture the image
-    picam2.capture_file(filename)
-    
-    # Stop the camera
-    picam2.stop()
+    with tracing.span("capture"):
+        camera.capture_file(filename)
+    photo_store.add(filename)
+    return None
 
 
 
-def analyse_image(filename):
-    """Processes an image file to generate a caption using a pre-trained model."""
-    # Load pre-trained models
-    llm_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    llm_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-    
+def analyse_image(image, cancelled=None):
+    """Generates a caption for an image file or in-memory RGB frame using the resident pre-trained model.
+
+    Once the optional `cancelled` event is set generation stops early (and does not start at all if already set).
+    """
+    if cancelled is not None and cancelled.is_set():
+        return None
     try:
-        # Open and process the image
-        with Image.open(os.path.join(base_dir, filename)).convert('RGB') as raw_image:
-            inputs = llm_processor(raw_image, return_tensors="pt")
-            outputs = llm_model.generate(**inputs)
-            caption = llm_processor.decode(outputs[0], skip_special_tokens=True)
+        if isinstance(image, str):
+            # Open and process the image file
+            with Image.open(os.path.join(base_dir, image)).convert('RGB') as raw_image:
+                caption = caption_engine.caption(raw_image, cancelled=cancelled)
+        else:
+            # The frame goes straight to the processor without any encoding or conversion
+            caption = caption_engine.caption(image, cancelled=cancelled)
         
         return caption
     
     except Exception as e:
         print(f"An error occurred: {e}")
-        return "Error processing the image."
+        return ERROR_MESSAGE
 
 
 
-def play_sound(musicName):
-    """Plays a sound file from the sounds dictionary."""
-    #  Play the audio file
-    pygame.mixer.init()
-    pygame.mixer.music.load(sounds.get(musicName))
-    pygame.mixer.music.play()
+def wait_for_model():
+    """Waits for the caption model of a press made during startup; returns False if it failed to load or timed out."""
+    try:
+        with tracing.span("model_wait"):
+            caption_engine.load()
+        return True
     
-    while pygame.mixer.music.get_busy():
-        pygame.time.Clock().tick(10)        # Wait for the audio to finish playing
+    except Exception as e:
+        print(f"An error occurred while loading the model: {e}")
+        return False
 
 
 
-def convert_text_to_speech(speech_text):
-    """Converts text to speech and plays it back."""
-    tts = gTTS(text=speech_text, lang='en')
-    tts.save("speech.mp3")
+def iterate_queue(words):
+    """Yields items from a queue until the None sentinel arrives."""
+    while True:
+        word = words.get()
+        if word is None:
+            return
+        yield word
+
+
+
+def analyse_and_announce_streaming(image, cancelled=None, first_word=None):
+    """Streams the caption word by word into speech and the LCD while it is being generated.
+
+    Returns once the LCD shows the caption; speech keeps playing on the audio
+    engine so a new press can interrupt it. Once the optional `cancelled` event
+    is set, generation stops and nothing more is spoken or displayed (nothing
+    is generated at all if it is already set). `first_word` is set when the
+    first word is announced.
+    """
+    if cancelled is not None and cancelled.is_set():
+        return None
+    is_cancelled = lambda: cancelled is not None and cancelled.is_set()
     
-    #  Play the audio file
-    pygame.mixer.init()
-    pygame.mixer.music.load("speech.mp3")
-    pygame.mixer.music.play()
+    # Synthesis and playback run on the speaker's own threads; the LCD renderer never blocks, so it is fed from here
+    speech_words = Queue()
+    speaker.speak_stream(iterate_queue(speech_words), wait=False)
+    shown = []
     
-    while pygame.mixer.music.get_busy():
-        pygame.time.Clock().tick(10)        # Wait for the audio to finish playing
+    def announce(word):
+        if first_word is not None:
+            first_word.set()
+        speech_words.put(word)
+        shown.append(word)
+        lcd_renderer.show(" ".join(shown), anchor_end=True)   # Keep the newest words visible
     
-    # Delete the audio file
-    os.remove("speech.mp3")
+    try:
+        if isinstance(image, str):
+            with Image.open(os.path.join(base_dir, image)) as raw_image:
+                image = raw_image.convert('RGB')
+        
+        stream = caption_engine.caption_stream(image, cancelled=cancelled)
+        for word in stream:
+            if not is_cancelled():
+                announce(word)
+        caption = stream.text
+        print(f"First word after {stream.time_to_first_word or 0:.2f}s, full caption after {stream.total_time:.2f}s")
+    
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        caption = ERROR_MESSAGE
+        if not is_cancelled():
+            shown.clear()
+            for word in caption.split():
+                announce(word)
+    
+    finally:
+        speech_words.put(None)
+    
+    # Scroll the complete text, unless a newer press or a long press has taken over the LCD
+    if shown and not is_cancelled():
+        display_message(" ".join(shown))
+    return caption
+
+
+
+def play_sound(musicName, wait=True):
+    """Plays a preloaded sound from the sounds dictionary."""
+    request = audio.play(musicName)
+    if wait:
+        request.wait()                      # Wait for the audio to finish playing
+
+
+
+def convert_text_to_speech(speech_text, wait=True, label="speech"):
+    """Converts text to speech and plays it back, starting as soon as the first phrase is ready."""
+    speaker.speak(speech_text, wait=wait, label=label)
 
 
 
 def display_message(txt, sleep_time=0):
-    """Displays a message on the LCD with a left scrolling effect."""
-    lcd.clear()
-    txt = txt.strip() + ' '                 # Ensure there's a space after the text
-    n = lcd_columns
-    
-    while True:
-        lcd.clear()                         # Clear the display to update the scrolling text
-        sleep(0.1)
-        lcd.message = txt[:lcd_columns]     # Show the first part of the text on the LCD
-        sleep(0.2)                          # Delay to control the speed of the scroll
-        txt = txt[1:] + txt[0]              # Rotate text to the left
-        
-        if n >= len(txt): 
-            break
-        n += 1
+    """Shows a message on the LCD, scrolling it over both rows if it is too long (returns immediately)."""
+    lcd_renderer.show(txt)
     
     if sleep_time > 0:
         sleep(sleep_time)
-        lcd.clear()
+        lcd_renderer.clear()
 
 
 
 def save_user_interaction(current_time, caption, filename):
-    with open(os.path.join(base_dir, "data", "history.json"), "r") as file:
-        data = json.load(file)
-    
-    # Append the new data to the existing list
-    data.append(dict(
-        createdAt = current_time.isoformat(),
-        caption = caption,
-        filename = filename
-    ))
-    
-    # Save the updated data to the file
-    json.dump(data, open(os.path.join(base_dir, "data", "history.json"), "w"))
+    """Appends the interaction, with the generation settings and the spans traced so far, to the history store and returns its record id."""
+    trace = tracing.current()
+    with tracing.span("history_write"):
+        extra = dict(trace=trace.to_dict()) if trace is not None else {}
+        if caption_engine.last_generation is not None:
+            extra["generation"] = caption_engine.last_generation
+        return history.add(current_time.isoformat(), caption, filename, **extra)
+
+
+
+def save_trace(record_id, trace):
+    """Stores the latest spans of a press (speech keeps adding them after the press is handled) on its record."""
+    try:
+        history.update_extra(record_id, trace=trace.to_dict())
+    except Exception as e:
+        print(f"An error occurred while saving the trace: {e}")
 
 
 
@@ -207,59 +402,227 @@ def process_two_functions_with_threading(func1, args1, func2, args2):
 
 
 
-def main():
-    """Main function to handle button press logic and process image."""
-    global prev_button_state, press_time_start, press_time_end
+def handle_short_press():
+    """Captures an image, captions it and speaks the result; returns the id of the history record."""
+    # Record the current time when the button press was registered
+    current_time = datetime.now()
+    # Reserve a unique filename for the photo, stamped with the capture time
+    filename = photo_store.new_filename(current_time)
+    
+    # Capture an image using the constructed filename
+    frame = capture_image(filename=filename)
     
-    # Read the state of the switch/button
-    button_state = GPIO.input(BUTTON_PIN)
-    time.sleep(DEBOUNCE_TIME)   # Sleep to debounce the button
-
-    # Detect button press
-    if prev_button_state == GPIO.HIGH and button_state == GPIO.LOW:  # Button is pressed
-        press_time_start = time.time()
-    elif prev_button_state == GPIO.LOW and button_state == GPIO.HIGH:  # Button is released
-        press_time_end = time.time()
-        press_duration = press_time_end - press_time_start
+    # A press during startup is captured right away and captioned as soon as the model has loaded
+    model_ready = True
+    if not caption_engine.is_loaded:
+        convert_text_to_speech("Still starting up, one moment...", True, "prompt")
+        model_ready = wait_for_model()
+
+    # Simultaneously display a message on the LCD and play a sound
+    with tracing.span("shutter_prompt"):
+        process_two_functions_with_threading(display_message, ("Smile for the camera!",), play_sound, ("camera",))
+    
+    # Display a processing message and convert the displayed text to speech concurrently
+    process_two_functions_with_threading(convert_text_to_speech, ("Processing image...", True, "prompt"), display_message, ("Processing image...",))
+    if STREAM_CAPTIONS and model_ready:
+        # Speak and display the caption while it is being generated
+        caption = analyse_and_announce_streaming(frame if frame is not None else filename)
+        # Log this interaction for future reference or analysis
+        record_id = save_user_interaction(current_time, caption, filename)
+    else:
+        # Analyze the captured image and retrieve a caption (or announce the error if the model could not be loaded)
+        caption = analyse_image(frame if frame is not None else filename) if model_ready else ERROR_MESSAGE
+        # Log this interaction for future reference or analysis
+        record_id = save_user_interaction(current_time, caption, filename)
+        
+        # Display the image caption and play a sound indicating the end of the process
+        # (speech continues in the background so the next press can interrupt it)
+        process_two_functions_with_threading(convert_text_to_speech, (caption, False), display_message, (caption,))
+    
+    # Let the caption scroll through once, then clear it from the LCD
+    with tracing.span("lcd_scroll"):
+        lcd_renderer.wait_idle(hold=CAPTION_HOLD_TIME)
+    lcd_renderer.clear()
+    # Prepare the system for the next interaction by indicating readiness (the sound follows the caption)
+    process_two_functions_with_threading(display_message, ("Ready...",), play_sound, ("start", False))
+    return record_id
+
+
+
+async def run_short_press():
+    """Pipelined version of handle_short_press; returns the id of the history record.
+
+    Inference starts as soon as the frame is captured, while the shutter
+    sound and "Processing image..." play. The history write overlaps the LCD
+    scroll. Cancelling the task (a new press) stops inference and the
+    announcement of the caption; a caption that was already complete is
+    still recorded.
+    """
+    current_time = datetime.now()
+    filename = photo_store.new_filename(current_time)
+    cancelled, first_word = Event(), Event()
+    caption_task = record_task = None
+    
+    try:
+        frame = await asyncio.to_thread(capture_image, filename)
+        image = frame if frame is not None else filename
+        
+        # A press during startup is captured right away and captioned as soon as the model has loaded
+        model_ready = True
+        if not caption_engine.is_loaded:
+            await asyncio.to_thread(convert_text_to_speech, "Still starting up, one moment...", True, "prompt")
+            model_ready = await asyncio.to_thread(wait_for_model)
+        streaming = STREAM_CAPTIONS and model_ready
         
-        # Check if the duration of a button press is short
-        if press_duration < SHORT_PRESS_TIME:
-            # Record the current time when the button press was registered
-            current_time = datetime.now()
-            # Construct a filename for saving the photo with a timestamp
-            filename = os.path.join("data", f"photo_{current_time.strftime('%Y%m%d_%H%M%S')}.png")
-            
-            # Capture an image using the constructed filename
-            capture_image(filename=filename)
-            # Simultaneously display a message on the LCD and play a sound
-            process_two_functions_with_threading(display_message, ("Smile for the camera!",), play_sound, ("camera",))
-            
-            # Display a processing message and convert the displayed text to speech concurrently
-            process_two_functions_with_threading(convert_text_to_speech, ("Processing image...",), display_message, ("Processing image...",))
-            # Analyze the captured image and retrieve a caption
-            caption = analyse_image(filename=filename)
-            # Log this interaction for future reference or analysis
-            save_user_interaction(current_time, caption, filename)
-            
-            # Display the image caption and play a sound indicating the end of the process
-            process_two_functions_with_threading(convert_text_to_speech, (caption,), display_message, (caption,))
-            
-            # Clear any previous messages from the LCD
-            lcd.clear()
-            # Prepare the system for the next interaction by indicating readiness
-            process_two_functions_with_threading(display_message, ("Ready...",), play_sound, ("start",))
+        # Queue the feedback first so the audio engine plays it ahead of the caption, then start inference alongside it
+        lcd_renderer.show("Smile for the camera!")
+        shutter = audio.play("camera")
+        speaker.speak("Processing image...", wait=False, label="prompt")
+        if streaming:
+            caption_task = asyncio.ensure_future(asyncio.to_thread(analyse_and_announce_streaming, image, cancelled, first_word))
+        elif model_ready:
+            caption_task = asyncio.ensure_future(asyncio.to_thread(analyse_image, image, cancelled))
+        
+        with tracing.span("shutter_prompt"):
+            await asyncio.to_thread(shutter.wait)
+        if not first_word.is_set():
+            lcd_renderer.show("Processing image...")
+        
+        # Without a model the error is announced in place of the caption
+        caption = await asyncio.shield(caption_task) if caption_task is not None else ERROR_MESSAGE
+        # The record is written even if the run is cancelled from here on
+        record_task = asyncio.ensure_future(asyncio.to_thread(save_user_interaction, current_time, caption, filename))
+        if not streaming:
+            speaker.speak(caption, wait=False)
+            lcd_renderer.show(caption)
+        
+        # Let the caption scroll through once while the history is written, then clear it from the LCD
+        with tracing.span("lcd_scroll"):
+            await asyncio.to_thread(lcd_renderer.wait_idle, None, CAPTION_HOLD_TIME)
+        record_id = await asyncio.shield(record_task)
+        lcd_renderer.clear()
+        lcd_renderer.show("Ready...")
+        audio.play("start")
+        return record_id
+    
+    except asyncio.CancelledError:
+        cancelled.set()
+        if record_task is None and caption_task is not None and caption_task.done() and not caption_task.cancelled():
+            record_task = asyncio.ensure_future(asyncio.to_thread(save_user_interaction, current_time, caption_task.result(), filename))
+        raise
+    
+    finally:
+        # Hand the record id to the trace even when cancelled, once the write has finished
+        if record_task is not None:
+            await asyncio.wait([record_task])
+
+
+
+async def run_press(event):
+    """Traces one short press through the pipelined handler."""
+    trace = tracing.tracer.begin(event.kind, start=event.released_at)
+    trace.add("button_pickup", event.released_at)
+    record_id = None
+    try:
+        record_id = await run_short_press()
+        return record_id
+    finally:
+        trace.add("press_total", trace.start)
+        tracing.tracer.finish(on_update=lambda trace: save_trace(record_id, trace), trace=trace)
+
+
+
+def main():
+    """Main function to wait for the next button press event and process it.
+
+    With ASYNC_PIPELINE the press is handed to the pipeline runner and a
+    concurrent.futures.Future of its record id is returned, so the next press
+    is picked up (and cancels the run) while this one is still being processed.
+    """
+    # Block until the interrupt callback queues a press
+    event = button.get()
+    print(f"{event.kind.capitalize()} press ({event.duration:.2f}s), picked up {time.monotonic() - event.released_at:.3f}s after release")
+    
+    # Any press cuts off a caption that is still being spoken
+    audio.interrupt()
+    
+    if ASYNC_PIPELINE:
+        # A short press replaces the run in flight, a long press only cancels it
+        if event.kind == SHORT_PRESS:
+            return runner.run(run_press, event)
+        runner.cancel()
+        display_message("Ready...")
+        return None
     
-    prev_button_state = button_state
+    # Check if the button press is short
+    if event.kind == SHORT_PRESS:
+        # Trace every stage from the button release; spans that arrive later (speech playback) update the record
+        trace = tracing.tracer.begin(event.kind, start=event.released_at)
+        trace.add("button_pickup", event.released_at)
+        record_id = handle_short_press()
+        trace.add("press_total", trace.start)
+        tracing.tracer.finish(on_update=lambda trace: save_trace(record_id, trace))
+
+
+
+def load_in_background():
+    """Prepares the fixed prompts, then loads the captioning model (in the inference process by default)."""
+    with tracing.detached():
+        tts.prefetch(FIXED_PROMPTS)
+        try:
+            caption_engine.load()
+        except Exception as e:
+            # The first press retries the load
+            print(f"An error occurred while loading the caption model: {e}")
+            return
+    startup_times["model_ready"] = time.monotonic() - STARTED_AT
+    print(f"Model ready {startup_times['model_ready']:.2f}s after start")
+
+
+
+def startup():
+    """Starts the peripherals and announces readiness, then loads the model in the background.
+
+    Presses arriving before the model is ready stay queued by the button source;
+    returns the loader thread.
+    """
+    lcd_renderer.start()
+    audio.start()
+    button.start()
+    runner.start()
+    loader = Thread(target=load_in_background, daemon=True)
+    loader.start()
+    
+    startup_times["ready"] = time.monotonic() - STARTED_AT
+    print(f"Ready {startup_times['ready']:.2f}s after start")
+    process_two_functions_with_threading(display_message, ("Ready...",), play_sound, ("start",))
+    return loader
+
+
+
+def shutdown():
+    """Powers the peripherals down."""
+    runner.stop()
+    if CAPTION_CACHE:
+        print(f"Caption cache: {caption_engine.cache.stats()}")
+    camera.stop()
+    photo_store.stop()
+    button.stop()
+    audio.stop()
+    if INFERENCE_PROCESS:
+        caption_engine.stop()
+    if not SIMULATE_HARDWARE:
+        GPIO.cleanup()
+    display_message("Exiting...", 5)
+    lcd_renderer.stop()
 
 
 
 if __name__ == "__main__":
     try:
-        lcd.clear()
-        process_two_functions_with_threading(display_message, ("Ready...",), play_sound, ("start",))
+        startup()
         while True:
             main()
         
     except KeyboardInterrupt:
-        GPIO.cleanup()
-        display_message("Exiting...", 5)
\ No newline at end of file
+        shutdown()
\ No newline at end of file
@@ -0,0 +1,170 @@
+# Standard library imports
+import os
+import time
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+# Third-party imports
+import cv2
+import numpy as np
+
+
+# Setup base directory for file paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default photo directory (relative to the project directory, as stored in the history)
+PHOTO_DIR = "data"
+
+# Default archival encoding settings
+JPEG_QUALITY = 90
+MAX_DIMENSION = None            # Longest side in pixels after downscaling, None keeps the original size
+
+# Default disk quota for the stored photos
+QUOTA_BYTES = 2 * 1024 ** 3     # 2 GB
+
+# Photos without a history record are only evicted early once they are this old (their caption may still be running)
+ORPHAN_AGE = 600
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+
+def encode_jpeg(frame, quality=JPEG_QUALITY, max_dimension=MAX_DIMENSION):
+    """Encodes an RGB (or RGBX) frame as JPEG bytes, downscaling its longest side to max_dimension."""
+    import simplejpeg
+
+    frame = frame[:, :, :3]
+    height, width = frame.shape[:2]
+    if max_dimension and max(height, width) > max_dimension:
+        scale = max_dimension / max(height, width)
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=quality, colorspace="RGB")
+
+
+
+class PhotoStore:
+    """Archives captured frames as JPEG on a background thread and keeps the photo directory under a disk quota.
+
+    File names carry the capture time down to the microsecond and are reserved
+    when handed out, so two presses in the same second never overwrite each
+    other. When the quota is exceeded, photos whose upload is confirmed go
+    first, oldest first; photos still waiting for upload are only evicted as a
+    last resort and their history record is flagged with photoEvicted.
+    """
+
+    def __init__(self, history=None, directory=PHOTO_DIR, quality=JPEG_QUALITY, max_dimension=MAX_DIMENSION,
+                 quota_bytes=QUOTA_BYTES):
+        self.history = history
+        self.directory = directory
+        self.quality = quality
+        self.max_dimension = max_dimension
+        self.quota_bytes = quota_bytes
+        self.evicted = 0                # Photos removed to stay under the quota
+        self._reserved = set()          # Names handed out whose file may not exist yet
+        self._lock = Lock()
+        self._evict_lock = Lock()       # One eviction pass at a time
+        self._encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photo-store")
+        os.makedirs(os.path.join(base_dir, directory), exist_ok=True)
+        self._sizes = {path: os.path.getsize(os.path.join(base_dir, path)) for path in self._photos()}
+        self.used_bytes = sum(self._sizes.values())
+
+
+    def _photos(self):
+        """Relative paths of the photos currently in the directory."""
+        for name in os.listdir(os.path.join(base_dir, self.directory)):
+            if name.startswith("photo_") and name.lower().endswith(PHOTO_EXTENSIONS):
+                yield os.path.join(self.directory, name)
+
+
+    def new_filename(self, created_at, extension=".jpg"):
+        """Reserves and returns a unique relative path for a photo taken at created_at (a datetime)."""
+        stem = os.path.join(self.directory, f"photo_{created_at.strftime('%Y%m%d_%H%M%S_%f')}")
+        with self._lock:
+            filename, suffix = stem + extension, 1
+            while filename in self._reserved or os.path.exists(os.path.join(base_dir, filename)):
+                filename, suffix = f"{stem}_{suffix}{extension}", suffix + 1
+            self._reserved.add(filename)
+        return filename
+
+
+    def save(self, frame, filename):
+        """Queues a frame for encoding to filename; returns a Future of the number of bytes written."""
+        return self._encoder.submit(self._write, frame, filename)
+
+
+    def _write(self, frame, filename):
+        path = os.path.join(base_dir, filename)
+        try:
+            data = encode_jpeg(frame, self.quality, self.max_dimension)
+            # Write under a temporary name and rename, so the upload daemon never sees a partial file
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"An error occurred while saving {filename}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._reserved.discard(filename)
+        self.add(filename)
+        return len(data)
+
+
+    def add(self, filename):
+        """Accounts for a photo written by someone else (e.g. the camera) and enforces the quota."""
+        with self._lock:
+            self._reserved.discard(filename)
+            size = os.path.getsize(os.path.join(base_dir, filename))
+            self.used_bytes += size - self._sizes.get(filename, 0)
+            self._sizes[filename] = size
+        if self.used_bytes > self.quota_bytes:
+            self.enforce_quota()
+
+
+    def _eviction_order(self):
+        """Photos in the order they are evicted: confirmed uploads and old orphans first, then pending ones, oldest first."""
+        with self._lock:
+            paths = [path for path in self._sizes if path not in self._reserved]
+        records = self.history.by_filenames(paths) if self.history is not None else {}
+        now = time.time()
+
+        def key(path):
+            record = records.get(path)
+            try:
+                modified = os.path.getmtime(os.path.join(base_dir, path))
+            except OSError:
+                modified = 0
+            if record is None:
+                disposable = now - modified > ORPHAN_AGE
+            else:
+                disposable = record["uploaded"] or record["blobUploaded"]
+            return (not disposable, modified)
+
+        return [(path, records.get(path)) for path in sorted(paths, key=key)]
+
+
+    def enforce_quota(self):
+        """Deletes photos until the directory is back under the quota; returns how many were removed."""
+        removed = 0
+        with self._evict_lock:
+            for path, record in self._eviction_order():
+                if self.used_bytes <= self.quota_bytes:
+                    break
+                if record is not None and not (record["uploaded"] or record["blobUploaded"]):
+                    print(f"Photo store over quota, evicting {path} before it was uploaded")
+                    self.history.update_extra(record["id"], photoEvicted=True)
+                try:
+                    os.remove(os.path.join(base_dir, path))
+                except FileNotFoundError:
+                    pass    # Already removed by worker.py after its upload
+                with self._lock:
+                    self.used_bytes -= self._sizes.pop(path, 0)
+                removed += 1
+            self.evicted += removed
+        return removed
+
+
+    def stop(self):
+        """Waits for the queued photos to be written."""
+        self._encoder.shutdown(wait=True)
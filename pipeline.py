@@ -0,0 +1,69 @@
+# Standard library imports
+import asyncio
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Threads shared by all pipeline runs for blocking stages (capture, inference, history writes, waits); speech
+# synthesis runs on its own threads. A cancelled run keeps a few of them busy until decoding stops at the next token
+PIPELINE_WORKERS = 8
+
+
+
+class PipelineRunner:
+    """Runs press pipelines (coroutines) one at a time on an event loop thread with a reused thread pool.
+
+    Starting a run cancels the one in flight and waits for it to unwind, so a
+    new press always starts from a clean state. Blocking stages are run with
+    asyncio.to_thread, which uses the runner's pool.
+    """
+
+    def __init__(self, workers=PIPELINE_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self._task = None
+        self._thread = Thread(target=self.loop.run_forever, daemon=True)
+
+
+    def start(self):
+        self._thread.start()
+        return self
+
+
+    async def _replace_current(self, task):
+        """Makes `task` the run in flight, cancelling the previous one and waiting for it to unwind."""
+        previous, self._task = self._task, task
+        if previous is not None and not previous.done():
+            previous.cancel()
+            await asyncio.wait([previous])
+
+
+    async def _run(self, coroutine_function, args):
+        await self._replace_current(asyncio.current_task())
+        return await coroutine_function(*args)
+
+
+    @staticmethod
+    def _report(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"An error occurred while handling the press: {future.exception()!r}")
+
+
+    def run(self, coroutine_function, *args):
+        """Cancels the run in flight and starts coroutine_function(*args); returns a concurrent.futures.Future of its result."""
+        future = asyncio.run_coroutine_threadsafe(self._run(coroutine_function, args), self.loop)
+        future.add_done_callback(self._report)
+        return future
+
+
+    def cancel(self):
+        """Cancels the run in flight and waits until it has unwound."""
+        asyncio.run_coroutine_threadsafe(self._replace_current(None), self.loop).result()
+
+
+    def stop(self):
+        self.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1)
+        self.executor.shutdown(wait=False)
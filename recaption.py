@@ -0,0 +1,148 @@
+# Standard library imports
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Imports for image processing
+from PIL import Image
+
+# Local imports
+from caption_engine import CaptionEngine, BACKENDS, GENERATION_POLICIES, DEFAULT_POLICY
+from history_store import HistoryStore, HISTORY_DB
+
+
+# Setup base directory for file paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default batching and loader settings
+BATCH_SIZE = 8
+LOADER_THREADS = 2
+PREFETCH_BATCHES = 2        # Batches decoded ahead of the one being captioned
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+
+def load_image(path):
+    """Decodes an image file into an RGB PIL image."""
+    with Image.open(os.path.join(base_dir, path)) as image:
+        return image.convert("RGB")
+
+
+
+def directory_items(directory, history):
+    """Yields (path, history record id or None) for every image under a directory."""
+    # History filenames are relative to the project directory, e.g. data/photo_....jpg
+    ids = {record["filename"]: record["id"] for record in history.all()}
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.relpath(os.path.join(root, name), base_dir)
+                yield path, ids.get(path)
+
+
+
+def history_items(history, since=None):
+    """Yields (path, record id) for history records whose photo is still on disk."""
+    records = history.since(since) if since else history.all()
+    for record in records:
+        if os.path.exists(os.path.join(base_dir, record["filename"])):
+            yield record["filename"], record["id"]
+
+
+
+def batches(items, batch_size, loader, prefetch):
+    """Groups items into batches of decoded images, keeping up to `prefetch` batches decoding in the loader pool."""
+    pending = deque()
+    items = iter(items)
+
+    def submit_batch():
+        batch = [item for _, item in zip(range(batch_size), items)]
+        if batch:
+            pending.append([(item, loader.submit(load_image, item[0])) for item in batch])
+
+    for _ in range(prefetch + 1):
+        submit_batch()
+    while pending:
+        batch = pending.popleft()
+        submit_batch()
+        loaded = []
+        for item, future in batch:
+            try:
+                loaded.append((item, future.result()))
+            except Exception as e:
+                print(f"An error occurred while loading {item[0]}: {e}", file=sys.stderr)
+        if loaded:
+            yield loaded
+
+
+
+def recaption(engine, items, history, batch_size=BATCH_SIZE, loader_threads=LOADER_THREADS,
+              prefetch=PREFETCH_BATCHES, output=None, dry_run=False):
+    """Captions items in batches while the next batches decode, writing each batch back to the history in one transaction.
+
+    Returns (images captioned, seconds spent).
+    """
+    engine.load()
+    count = 0
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=loader_threads) as loader:
+        for batch in batches(items, batch_size, loader, prefetch):
+            captions = engine.caption_batch([image for _, image in batch])
+            updates = []
+            for ((path, record_id), _), caption in zip(batch, captions):
+                if output is not None:
+                    output.write(json.dumps(dict(filename=path, id=record_id, caption=caption)) + "\n")
+                if record_id is not None:
+                    updates.append((record_id, caption, dict(
+                        captionModel=engine.model_name, captionBackend=engine.backend.name, generation=engine.last_generation,
+                    )))
+            if updates and not dry_run:
+                history.update_captions(updates)
+
+            count += len(batch)
+            elapsed = time.perf_counter() - start_time
+            print(f"{count} images captioned, {count / elapsed:.2f} images/s", file=sys.stderr)
+
+    return count, time.perf_counter() - start_time
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate captions for stored photos with batched inference.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Caption every image under this directory (matching history records are updated)")
+    source.add_argument("--history", action="store_true", help="Caption every history record whose photo is still on disk")
+    parser.add_argument("--since", help="With --history, only records created at or after this ISO timestamp")
+    parser.add_argument("--db", default=HISTORY_DB, help="History database")
+    parser.add_argument("--backend", default=os.getenv("CAPTION_BACKEND", "pytorch"), choices=sorted(BACKENDS), help="Caption backend")
+    parser.add_argument("--policy", default=DEFAULT_POLICY, choices=sorted(GENERATION_POLICIES), help="Decoding strategy")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Images per generate call")
+    parser.add_argument("--loader-threads", type=int, default=LOADER_THREADS, help="Threads decoding images ahead of inference")
+    parser.add_argument("--output", help="Also write every caption as a JSON line to this file")
+    parser.add_argument("--dry-run", action="store_true", help="Do not modify the history")
+    args = parser.parse_args()
+
+    history = HistoryStore(args.db)
+    items = directory_items(args.dir, history) if args.dir else history_items(history, args.since)
+    engine = CaptionEngine(backend=args.backend, policy=args.policy)
+
+    output = open(args.output, "w") if args.output else None
+    try:
+        count, elapsed = recaption(engine, items, history, args.batch_size, args.loader_threads,
+                                   output=output, dry_run=args.dry_run)
+    finally:
+        if output is not None:
+            output.close()
+        history.close()
+
+    print(f"Captioned {count} images in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.2f} images/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# Standard library imports
+import io
+import os
+import re
+import time
+import shutil
+import hashlib
+import subprocess
+from queue import Queue, Full
+from threading import Lock, Thread
+from collections import OrderedDict, deque
+
+# Per-stage latency tracing
+import tracing
+
+
+# Setup base directory for file paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default location and size limits of the synthesized-audio cache
+CACHE_DIR = os.path.join(base_dir, "cache", "tts")
+MEMORY_CACHE_BYTES = 8 * 1024 * 1024    # 8 MB of audio kept in memory
+DISK_CACHE_BYTES = 64 * 1024 * 1024     # 64 MB of audio kept on disk
+
+# Longest phrase synthesized as one chunk when streaming
+MAX_PHRASE_CHARS = 60
+
+# Words gathered before the first phrase of a word stream is synthesized (kept short so speech starts early)
+FIRST_PHRASE_WORDS = 3
+
+# Utterances whose time to first audio is kept for benchmarks
+TIMING_HISTORY = 256
+
+# Backend used when the requested one cannot run on this device (e.g. espeak-ng is not installed)
+FALLBACK_BACKEND = "gtts"
+
+
+
+class GTTSBackend:
+    """Online synthesis through Google Translate's TTS endpoint."""
+
+    name = "gtts"
+    format = "mp3"
+
+    def __init__(self, lang="en", voice="com"):
+        self.lang = lang
+        self.voice = voice      # gTTS picks the accent through the Google domain (tld)
+
+
+    def available(self):
+        return True
+
+
+    def synthesize(self, text):
+        """Returns MP3 bytes for the text."""
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang, tld=self.voice).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+
+class EspeakBackend:
+    """Offline synthesis with the local espeak-ng engine."""
+
+    name = "espeak"
+    format = "wav"
+
+    def __init__(self, lang="en", voice="en-us", speed=160, executable="espeak-ng"):
+        self.lang = lang
+        self.voice = voice
+        self.speed = speed
+        self.executable = executable
+
+
+    def available(self):
+        """Whether the espeak-ng executable is installed."""
+        return shutil.which(self.executable) is not None
+
+
+    def synthesize(self, text):
+        """Returns WAV bytes for the text."""
+        result = subprocess.run(
+            [self.executable, "--stdout", "-v", self.voice, "-s", str(self.speed), text],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+        )
+        return result.stdout
+
+
+
+# Available speech backends by name
+BACKENDS = {
+    GTTSBackend.name: GTTSBackend,
+    EspeakBackend.name: EspeakBackend,
+}
+
+
+
+class AudioCache:
+    """Content-addressed cache of synthesized audio with LRU eviction in memory and on disk."""
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_bytes=MEMORY_CACHE_BYTES, disk_bytes=DISK_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()    # key -> audio bytes, least recently used first
+        self._memory_size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    @staticmethod
+    def key(text, backend):
+        """Builds the cache key from the text, engine, voice and language."""
+        content = "\0".join([backend.name, backend.voice, backend.lang, text])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+
+    def _remember(self, key, data):
+        """Stores audio in memory and evicts the least recently used entries beyond the limit."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+
+    def get(self, key, fmt):
+        """Returns cached audio bytes, or None if the key is not cached."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            path = self._path(key, fmt)
+            try:
+                with open(path, "rb") as file:
+                    data = file.read()
+                os.utime(path)      # Mark as recently used for disk eviction
+            except OSError:
+                self.misses += 1
+                return None
+
+            self._remember(key, data)
+            self.hits += 1
+            return data
+
+
+    def put(self, key, fmt, data):
+        """Stores audio bytes in memory and on disk."""
+        with self._lock:
+            self._remember(key, data)
+
+            # Write through a temporary file so a crash never leaves a truncated entry behind
+            path = self._path(key, fmt)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+
+
+    def _evict_disk(self):
+        """Deletes the least recently used files until the disk cache fits its limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+
+class TextToSpeech:
+    """Synthesizes speech through a pluggable backend and serves repeated phrases from the cache."""
+
+    def __init__(self, backend="espeak", cache=None, **backend_options):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown speech backend '{backend}', expected one of {sorted(BACKENDS)}")
+
+        self.backend = BACKENDS[backend](**backend_options)
+        if not self.backend.available():
+            # Rather than failing every phrase (and leaving the device silent), speak through the fallback
+            print(f"Warning: the {backend} speech backend is not available, falling back to {FALLBACK_BACKEND}")
+            self.backend = BACKENDS[FALLBACK_BACKEND]()
+        self.cache = AudioCache() if cache is None else cache
+
+
+    @property
+    def format(self):
+        return self.backend.format
+
+
+    def synthesize(self, text):
+        """Returns audio bytes for the text in the backend's format."""
+        key = self.cache.key(text, self.backend)
+        data = self.cache.get(key, self.format)
+        if data is None:
+            data = self.backend.synthesize(text)
+            self.cache.put(key, self.format, data)
+        return data
+
+
+    def prefetch(self, phrases):
+        """Synthesizes fixed prompts ahead of time so they play instantly."""
+        for text in phrases:
+            try:
+                self.synthesize(text)
+            except Exception as e:
+                print(f"An error occurred while preparing '{text}': {e}")
+
+
+
+def split_phrases(text, max_chars=MAX_PHRASE_CHARS):
+    """Splits text at sentence and clause boundaries, breaking long clauses so no phrase exceeds max_chars."""
+    phrases = []
+    for part in re.split(r"(?<=[.!?;:,])\s+", text.strip()):
+        words, current = part.split(), ""
+        for word in words:
+            if current and len(current) + 1 + len(word) > max_chars:
+                phrases.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            phrases.append(current)
+    return phrases
+
+
+
+def group_words(words, max_chars=MAX_PHRASE_CHARS, first_phrase_words=FIRST_PHRASE_WORDS):
+    """Groups a stream of words into phrases, releasing a short first phrase as early as possible."""
+    current = []
+    first = True
+    for word in words:
+        current.append(word)
+        length = sum(len(w) + 1 for w in current)
+        if (first and len(current) >= first_phrase_words) or length >= max_chars or word[-1] in ".!?;:,":
+            yield " ".join(current)
+            current, first = [], False
+    if current:
+        yield " ".join(current)
+
+
+
+class StreamingSpeaker:
+    """Speaks text phrase by phrase, synthesizing the next phrase while the current one plays.
+
+    Every utterance gets its own thread for synthesis (and for the playback
+    wait when not waiting), so it never queues behind other work.
+    """
+
+    def __init__(self, tts, audio, max_chars=MAX_PHRASE_CHARS):
+        self.tts = tts
+        self.audio = audio                      # AudioEngine that plays the synthesized phrases
+        self.max_chars = max_chars
+        self.last_time_to_first_audio = None    # Seconds from speak() to the first phrase starting
+        self.last_total_time = None             # Seconds from speak() to the end of playback
+        self.time_to_first_audio = deque(maxlen=TIMING_HISTORY)    # (characters, seconds) of the most recent utterances
+
+
+    @staticmethod
+    def _hand_over(chunks, item, stopped):
+        """Puts an item in the player queue; returns False once playback has ended (nobody takes items any more)."""
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+
+    def _synthesize_all(self, phrases, chunks, stopped, trace=None, label="speech"):
+        """Producer: synthesizes phrases in order and hands them to the player until playback stops."""
+        for phrase in phrases:
+            if stopped.is_set():
+                return
+            try:
+                start = time.monotonic()
+                data = self.tts.synthesize(phrase)
+                if trace is not None:
+                    trace.add(f"{label}_synthesis", start)
+            except Exception as e:
+                print(f"An error occurred while synthesizing '{phrase}': {e}")
+                continue
+            if not self._hand_over(chunks, data, stopped):
+                return
+        self._hand_over(chunks, None, stopped)
+
+
+    def speak(self, text, wait=True, label="speech"):
+        """Plays the text, queueing each phrase gaplessly behind the previous one.
+
+        `label` prefixes the synthesis and playback spans recorded on the current trace.
+        Returns the PlaybackRequest, which is queued before this returns even when not waiting.
+        """
+        return self._start(split_phrases(text, self.max_chars), lambda: len(text), wait, label)
+
+
+    def speak_stream(self, words, wait=True, label="speech"):
+        """Plays words as they arrive (e.g. from a streaming caption), grouped into phrases."""
+        received = []
+
+        def collect():
+            for word in words:
+                received.append(word)
+                yield word
+
+        return self._start(group_words(collect(), self.max_chars), lambda: len(" ".join(received)), wait, label)
+
+
+    def _start(self, phrases, text_length, wait, label):
+        """Synthesizes phrases in the background and hands them to the audio engine as one request.
+
+        The request is queued right away, so utterances play in the order they were started.
+        """
+        from audio_engine import PRIORITY_SPEECH
+
+        # Bind the trace now, since the press may finish (and its trace close) before playback ends
+        trace = tracing.current()
+        start_time = time.perf_counter()
+        trace_start = time.monotonic()
+        chunks = Queue(maxsize=2)
+        request = self.audio.submit(chunks, PRIORITY_SPEECH)    # Polled, so a barge-in does not wait for the next phrase
+        args = (request, text_length, trace, label, start_time, trace_start)
+
+        def produce():
+            # Synthesis stops once the request is done, e.g. interrupted before all phrases were played
+            self._synthesize_all(phrases, chunks, request.done, trace, label)
+            if not wait:
+                self._finish(*args)
+
+        Thread(target=produce, daemon=True).start()
+        if wait:
+            self._finish(*args)
+        return request
+
+
+    def _finish(self, request, text_length, trace, label, start_time, trace_start):
+        """Waits for the utterance to end and records its timings."""
+        request.wait()
+
+        self.last_total_time = time.perf_counter() - start_time
+        self.last_time_to_first_audio = request.started_at - start_time if request.started_at else None
+        if trace is not None and self.last_time_to_first_audio is not None:
+            first_audio = trace_start + self.last_time_to_first_audio
+            trace.add(f"{label}_first_audio", trace_start, first_audio)
+            trace.add(f"{label}_playback", first_audio, trace_start + self.last_total_time)
+        if self.last_time_to_first_audio is not None:
+            self.time_to_first_audio.append((text_length(), self.last_time_to_first_audio))
+            print(f"Speech started after {self.last_time_to_first_audio:.2f}s, "
+                  f"{'interrupted' if request.interrupted else 'finished'} after {self.last_total_time:.2f}s")
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import random
+import argparse
+from threading import Thread
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+from button_input import SimulatedButtonSource
+
+POLL_INTERVAL = 0.1  # The old main loop slept 100 ms between GPIO reads
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(label, latencies):
+    print(f"{label:>14}: p50 {percentile(latencies, 50) * 1000:6.1f} ms, "
+          f"p95 {percentile(latencies, 95) * 1000:6.1f} ms, max {max(latencies) * 1000:6.1f} ms")
+
+
+def measure_event_queue(presses):
+    """Release-to-dequeue latency of the edge-triggered event queue."""
+    button = SimulatedButtonSource()
+    latencies = []
+    for _ in range(presses):
+        button.press(duration=random.uniform(0.05, 0.3))
+        event = button.get()
+        latencies.append(time.monotonic() - event.released_at)
+        time.sleep(random.uniform(0, POLL_INTERVAL))
+    return latencies
+
+
+def measure_polling(presses):
+    """Release-to-detection latency of the previous sleep-and-poll loop against a simulated pin."""
+    state = dict(pressed=False, released_at=None)
+    latencies = []
+
+    def poll():
+        prev = False
+        while len(latencies) < presses:
+            current = state["pressed"]
+            time.sleep(POLL_INTERVAL)
+            if prev and not current:
+                latencies.append(time.monotonic() - state["released_at"])
+            prev = current
+
+    poller = Thread(target=poll, daemon=True)
+    poller.start()
+    while len(latencies) < presses and poller.is_alive():
+        state["pressed"] = True
+        time.sleep(random.uniform(0.15, 0.3))
+        state["pressed"] = False
+        state["released_at"] = time.monotonic()
+        time.sleep(random.uniform(0.25, 0.4))
+    poller.join(timeout=1)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure button input latency without a Pi.")
+    parser.add_argument("--presses", type=int, default=30)
+    args = parser.parse_args()
+
+    report("event queue", measure_event_queue(args.presses))
+    report("100 ms polling", measure_polling(args.presses))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+from lcd_renderer import LCDRenderer, SimulatedLCD, LCD_COLUMNS
+
+MESSAGES = [
+    "Ready...",
+    "Smile for the camera!",
+    "Processing image...",
+    "a man sitting on a bench next to a dog",
+    "there is a kitchen with a stove, a sink and a refrigerator next to a window",
+]
+
+
+def old_display_message(lcd, txt):
+    """The previous scrolling loop from main.py, without its sleeps."""
+    lcd.clear()
+    txt = txt.strip() + ' '
+    n = LCD_COLUMNS
+    while True:
+        lcd.clear()
+        lcd.message = txt[:LCD_COLUMNS]
+        txt = txt[1:] + txt[0]
+        if n >= len(txt):
+            break
+        n += 1
+
+
+def main():
+    print(f"{'message':>40} | {'old writes':>10} | {'new writes':>10}")
+    for message in MESSAGES:
+        old_lcd = SimulatedLCD()
+        old_display_message(old_lcd, message)
+
+        new_lcd = SimulatedLCD()
+        renderer = LCDRenderer(new_lcd, scroll_interval=0.01).start()
+        new_lcd.writes = 0
+        renderer.show(message, loop=False)
+        time.sleep(0.05)
+        renderer.wait_idle()
+        time.sleep(0.05)
+        renderer.stop()
+
+        print(f"{message[:40]:>40} | {old_lcd.writes:10d} | {new_lcd.writes:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import warnings
+
+import numpy as np
+from transformers import BlipProcessor
+
+warnings.filterwarnings("ignore")
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+from camera_manager import yuv420_to_rgb
+from caption_engine import MODEL_NAME
+
+MAIN_SIZE = (1920, 1080)
+LORES_SIZE = (384, 384)
+
+
+def measure(label, make_frame, processor, repeats):
+    """Times preprocessing of one frame type and tracks the peak memory it allocates."""
+    timings = []
+    tracemalloc.start()
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        processor(images=make_frame(), return_tensors="pt")
+        timings.append(time.perf_counter() - start_time)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    print(f"{label:>28}: mean {sum(timings) / len(timings) * 1000:7.1f} ms, "
+          f"p50 {timings[len(timings) // 2] * 1000:7.1f} ms, peak {peak / 2**20:6.1f} MB")
+    return sum(timings) / len(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BLIP preprocessing cost of main vs lores camera frames.")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    processor = BlipProcessor.from_pretrained(MODEL_NAME)
+    rng = np.random.default_rng(0)
+
+    # Synthetic frames in the layouts the camera streams deliver
+    width, height = MAIN_SIZE
+    main_frame = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    width, height = LORES_SIZE
+    lores_frame = rng.integers(0, 256, (height * 3 // 2, width), dtype=np.uint8)
+
+    print(f"Main stream {MAIN_SIZE} vs lores stream {LORES_SIZE}, {args.repeats} repeats\n")
+    main_time, main_peak = measure("main (RGBX -> RGB)", lambda: main_frame[:, :, :3], processor, args.repeats)
+    lores_time, lores_peak = measure("lores (YUV420 -> RGB)", lambda: yuv420_to_rgb(lores_frame), processor, args.repeats)
+
+    print(f"\nSaved per press: {(main_time - lores_time) * 1000:.1f} ms preprocessing, "
+          f"{(main_peak - lores_peak) / 2**20:.1f} MB peak memory "
+          f"({main_frame.nbytes / lores_frame.nbytes:.0f}x fewer bytes captured)")
+
+
+if __name__ == "__main__":
+    main()
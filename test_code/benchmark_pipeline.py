@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=base_dir, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def wait_for_speech(trace, timeout):
+    """Waits until the spoken caption of a press has finished playing."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(name == "speech_playback" for name, _, _ in trace.spans):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def span_end(trace, name):
+    """Seconds from the button release to the end of the first span with this name, or None."""
+    for span_name, start, duration in trace.spans:
+        if span_name == name:
+            return start + duration
+    return None
+
+
+def distribution(values):
+    import tracing
+
+    if not values:
+        return None
+    return dict(p50=tracing.percentile(values, 50), p95=tracing.percentile(values, 95), p99=tracing.percentile(values, 99), max=max(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the capture-to-speech pipeline of main.py against simulated peripherals and report JSON.")
+    parser.add_argument("--images", required=True, help="Directory of sample images served by the simulated camera")
+    parser.add_argument("--presses", type=int, default=None, help="Number of button presses (defaults to one per image)")
+    parser.add_argument("--backend", default=os.getenv("CAPTION_BACKEND", "pytorch"), help="Caption backend (pytorch, int8 or onnx)")
+    parser.add_argument("--hold", type=float, default=0, help="Seconds each caption stays on the LCD (main.py uses 2)")
+    parser.add_argument("--scroll-interval", type=float, default=0.05, help="Seconds per LCD scroll step")
+    parser.add_argument("--speech-timeout", type=float, default=60, help="Longest wait for a caption to finish playing")
+    parser.add_argument("--sequential", action="store_true", help="Run the stages one after another (ASYNC_PIPELINE=0) to compare with the pipelined handler")
+    parser.add_argument("--inference-process", choices=("0", "1"), default=os.getenv("INFERENCE_PROCESS", "1"),
+                        help="Caption in a separate inference process (1, main.py's default) or in the pipeline's process (0)")
+    parser.add_argument("--caption-cache", action="store_true", help="Answer near-duplicate frames from the caption cache (off so every press measures inference)")
+    parser.add_argument("--output", help="Write the report to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Configure main.py before importing it, since it sets up its peripherals at import time
+    work_dir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    os.environ["SIMULATE_HARDWARE"] = "1"
+    os.environ["SIMULATED_IMAGE_DIR"] = os.path.abspath(args.images)
+    os.environ["HISTORY_DB"] = os.path.join(work_dir, "history.db")
+    os.environ["PHOTO_DIR"] = os.path.join(work_dir, "photos")     # Keep benchmark photos out of the device's data/
+    os.environ["TTS_CACHE_DIR"] = os.path.join(work_dir, "tts")
+    os.environ["CAPTION_BACKEND"] = args.backend
+    os.environ["ASYNC_PIPELINE"] = "0" if args.sequential else "1"
+    os.environ["CAPTION_CACHE"] = "1" if args.caption_cache else "0"
+    os.environ["INFERENCE_PROCESS"] = args.inference_process
+
+    # The pipeline's progress messages go to stderr so stdout carries only the report
+    with redirect_stdout(sys.stderr):
+        report = run(args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+def run(args):
+    import_start = time.perf_counter()
+    import main as app
+    import tracing
+    import_time = time.perf_counter() - import_start
+
+    app.CAPTION_HOLD_TIME = args.hold
+    app.lcd_renderer.scroll_interval = args.scroll_interval
+    presses = args.presses or len(app.picam2.images)
+
+    # Measure steady-state presses, so wait for the background model load first
+    app.startup().join()
+
+    cycle_times, first_audio_times = [], []
+    start_time = time.perf_counter()
+    for _ in range(presses):
+        app.button.press(duration=0.1)
+        run = app.main()
+        if run is not None:
+            run.result()    # The pipelined handler runs on the pipeline runner's loop
+        trace = tracing.tracer.recent[-1]
+        if not wait_for_speech(trace, args.speech_timeout):
+            print("Timed out waiting for the caption to be spoken", file=sys.stderr)
+        cycle_times.append(time.monotonic() - trace.start)
+        first_audio = span_end(trace, "speech_first_audio")
+        if first_audio is not None:
+            first_audio_times.append(first_audio)
+    wall_time = time.perf_counter() - start_time
+
+    records = app.history.all()
+    stages = tracing.summarize(records)
+    lcd_writes = app.lcd_renderer.total_writes
+    app.shutdown()
+
+    # ru_maxrss is in KB on Linux. The children's figure is the largest process that has exited (shutdown() ends the
+    # inference process), i.e. the one holding the model when it runs separately
+    ui_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    return dict(
+        commit = git_commit(),
+        backend = args.backend,
+        pipeline = "sequential" if args.sequential else "async",
+        inference_process = app.INFERENCE_PROCESS,
+        images = len(app.picam2.images),
+        presses = presses,
+        import_time = import_time,
+        time_to_ready = app.startup_times["ready"],
+        time_to_model_ready = app.startup_times["model_ready"],
+        wall_time = wall_time,
+        throughput_per_minute = presses / wall_time * 60,
+        release_to_first_caption_audio = distribution(first_audio_times),
+        release_to_speech_end = distribution(cycle_times),
+        stages = stages,
+        caption_cache = app.caption_engine.cache.stats() if app.CAPTION_CACHE else None,
+        lcd_writes_per_press = lcd_writes / presses,
+        peak_rss_mb = ui_rss_mb + children_rss_mb if app.INFERENCE_PROCESS else ui_rss_mb,   # Comparable across both modes
+        ui_peak_rss_mb = ui_rss_mb,
+        inference_peak_rss_mb = children_rss_mb if app.INFERENCE_PROCESS else None,
+        captions = [record["caption"] for record in records],
+    )
+
+
+if __name__ == "__main__":
+    main()
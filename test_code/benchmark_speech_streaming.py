@@ -0,0 +1,40 @@
+import os
+import sys
+import shutil
+import argparse
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+from audio_engine import AudioEngine
+from speech import AudioCache, TextToSpeech, StreamingSpeaker
+
+CAPTION = "a man sitting on a wooden bench next to a small brown dog in a park with tall trees behind them"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report time-to-first-audio as captions get longer.")
+    parser.add_argument("--engine", default="espeak", help="Speech engine (espeak or gtts)")
+    parser.add_argument("--max-repeats", type=int, default=4, help="Longest caption, in copies of the sample caption")
+    args = parser.parse_args()
+
+    # Use a throwaway cache so every phrase is synthesized for real
+    cache_dir = os.path.join(os.path.dirname(base_dir), "cache", "tts_benchmark")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    cache = AudioCache(cache_dir=cache_dir)
+    audio = AudioEngine({}).start()
+    speaker = StreamingSpeaker(TextToSpeech(backend=args.engine, cache=cache), audio)
+
+    for repeats in range(1, args.max_repeats + 1):
+        text = " and ".join([CAPTION] * repeats) + f" {repeats}"
+        speaker.speak(text)
+        if speaker.last_time_to_first_audio is None:
+            # Nothing was played, e.g. every phrase failed to synthesize
+            print(f"{len(text):4d} chars: no audio, gave up after {speaker.last_total_time:.2f}s")
+            continue
+        print(f"{len(text):4d} chars: first audio {speaker.last_time_to_first_audio:.2f}s, total {speaker.last_total_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+sys.path.insert(0, base_dir)
+
+import worker
+from history_store import HistoryStore
+from upload_emulator import start_emulator
+
+
+def create_backlog(work_dir, history, entries, image_bytes):
+    """Writes dummy photos and pending history records for them."""
+    os.makedirs(os.path.join(work_dir, "data"), exist_ok=True)
+    start = datetime(2024, 1, 1)
+    for n in range(entries):
+        created_at = start + timedelta(seconds=n)
+        filename = os.path.join("data", f"photo_{created_at.strftime('%Y%m%d_%H%M%S')}.png")
+        with open(os.path.join(work_dir, filename), "wb") as file:
+            file.write(os.urandom(image_bytes))
+        history.add(created_at.isoformat(), f"caption {n}", filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker.py uploads against a local emulator.")
+    parser.add_argument("--entries", type=int, default=40)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds added to every request")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    server, base_url, connection_string = start_emulator(latency=args.latency, failure_rate=args.failure_rate)
+    worker.API_BASE_URL = base_url
+    worker.BACKOFF_BASE = 0.05
+
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for concurrency in args.concurrency:
+            history = HistoryStore(os.path.join(work_dir, f"history_{concurrency}.db"), legacy_path=None)
+            create_backlog(work_dir, history, args.entries, args.image_kb * 1024)
+            session = worker.create_session(concurrency)
+            client = worker.create_container_client(connection_string, "images")
+            server.state.connections.clear()
+
+            start_time = time.perf_counter()
+            uploaded, failed = worker.upload_pending(history, session, client, concurrency=concurrency)
+            elapsed = time.perf_counter() - start_time
+
+            print(f"concurrency {concurrency:2d}: {uploaded} uploaded, {failed} failed in {elapsed:.2f}s "
+                  f"({uploaded / elapsed:.1f} entries/s, {len(server.state.connections)} connections)")
+            session.close()
+            history.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
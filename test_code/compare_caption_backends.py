@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import warnings
+from contextlib import redirect_stdout
+from difflib import SequenceMatcher
+from multiprocessing import get_context
+
+from PIL import Image
+
+warnings.filterwarnings("ignore")
+
+# Make the project modules importable when running from test_code
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+from caption_engine import BACKENDS, CaptionEngine
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def list_images(image_dir):
+    """Returns the sorted image files found in a directory."""
+    return sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def run_backend(backend, images):
+    """Captions every image with one backend and returns captions, timings and peak memory."""
+    # The engine's progress messages go to stderr so stdout carries only the report (e.g. with --json)
+    with redirect_stdout(sys.stderr):
+        engine = CaptionEngine(backend=backend).load()
+
+        captions, latencies = [], []
+        for image_path in images:
+            with Image.open(image_path).convert('RGB') as raw_image:
+                start_time = time.perf_counter()
+                captions.append(engine.caption(raw_image))
+                latencies.append(time.perf_counter() - start_time)
+
+    return dict(
+        backend = backend,
+        load_time = engine.load_time,
+        captions = captions,
+        latencies = latencies,
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+
+
+def caption_similarity(a, b):
+    """Word-level similarity between two captions (1.0 means identical)."""
+    return SequenceMatcher(None, a.split(), b.split()).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare caption backends on the same image set.")
+    parser.add_argument("image_dir", help="Directory of sample images")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--reference", default="pytorch", help="Backend whose captions are treated as ground truth")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    images = list_images(args.image_dir)
+    if not images:
+        sys.exit(f"No images found in {args.image_dir}")
+
+    # Run every backend in a fresh process so load time and peak memory are measured independently
+    results = {}
+    ctx = get_context("spawn")
+    for backend in args.backends:
+        with ctx.Pool(1) as pool:
+            results[backend] = pool.apply(run_backend, (backend, images))
+
+    reference = results.get(args.reference)
+    report = []
+    for backend, result in results.items():
+        latencies = sorted(result["latencies"])
+        row = dict(
+            backend = backend,
+            load_time = round(result["load_time"], 3),
+            mean_latency = round(sum(latencies) / len(latencies), 3),
+            p50_latency = round(latencies[len(latencies) // 2], 3),
+            max_latency = round(latencies[-1], 3),
+            peak_rss_mb = round(result["peak_rss_mb"], 1),
+        )
+        if reference is not None:
+            pairs = list(zip(result["captions"], reference["captions"]))
+            row["exact_match"] = round(sum(a == b for a, b in pairs) / len(pairs), 3)
+            row["similarity"] = round(sum(caption_similarity(a, b) for a, b in pairs) / len(pairs), 3)
+        report.append(row)
+
+    if args.json:
+        print(json.dumps(dict(images=len(images), reference=args.reference, results=report), indent=2))
+        return
+
+    print(f"\n{len(images)} images, reference backend: {args.reference}\n")
+    for row in report:
+        print(
+            f"{row['backend']:>8}: load {row['load_time']:.2f}s, "
+            f"mean {row['mean_latency']:.2f}s, p50 {row['p50_latency']:.2f}s, max {row['max_latency']:.2f}s, "
+            f"peak RSS {row['peak_rss_mb']:.0f} MB, "
+            f"exact {row.get('exact_match', 0):.0%}, similarity {row.get('similarity', 0):.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import time
+import xml.etree.ElementTree as ElementTree
+import random
+import argparse
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Well-known development storage account (the same one the Azurite emulator uses)
+ACCOUNT_NAME = "devstoreaccount1"
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+
+class EmulatorState:
+    """Everything the stand-in server has received, plus the simulated link characteristics."""
+
+    def __init__(self, latency=0.05, failure_rate=0.0, bandwidth=None):
+        self.latency = latency              # Seconds added to every request (round trip of a weak uplink)
+        self.failure_rate = failure_rate    # Fraction of requests answered with 503
+        self.bandwidth = bandwidth          # Bytes per second of request bodies, None for unlimited
+        self.records = []                   # Metadata posted to /api/todoes
+        self.blobs = {}                     # Blob path -> bytes
+        self.uncommitted = {}               # Blob path -> {block id: bytes} staged but not committed
+        self.block_puts = 0                 # Number of staged blocks received
+        self.requests = 0
+        self.connections = set()            # Client ports seen, i.e. TCP connections opened
+        self.lock = Lock()
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    """Serves the metadata API (/api/todoes, /api/test) and the blob, block and block-list calls of the Blob REST API."""
+
+    protocol_version = "HTTP/1.1"   # Keep connections alive so connection pooling is measurable
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.state.bandwidth:
+            time.sleep(len(body) / self.state.bandwidth)
+        return body
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-ms-request-id", str(random.getrandbits(64)))
+        self.send_header("x-ms-version", "2021-08-06")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _simulate_link(self):
+        """Applies latency and random failures; returns False if the request should fail."""
+        with self.state.lock:
+            self.state.requests += 1
+            self.state.connections.add(self.client_address[1])
+        time.sleep(self.state.latency)
+        return random.random() >= self.state.failure_rate
+
+    def do_GET(self):
+        if not self._simulate_link():
+            return self._reply(503)
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        if query.get("comp") == "blocklist":
+            with self.state.lock:
+                blocks = self.state.uncommitted.get(url.path, {})
+                items = "".join(f"<Block><Name>{b}</Name><Size>{len(d)}</Size></Block>" for b, d in blocks.items())
+            body = (
+                '<?xml version="1.0" encoding="utf-8"?><BlockList><CommittedBlocks />'
+                f"<UncommittedBlocks>{items}</UncommittedBlocks></BlockList>"
+            ).encode()
+            return self._reply(200, body, {"Content-Type": "application/xml"})
+        if url.path == "/api/test":
+            with self.state.lock:
+                body = json.dumps([dict(ImageUrl=r.get("ImageURL", "")[5:]) for r in self.state.records]).encode()
+            return self._reply(200, body, {"Content-Type": "application/json"})
+        self._reply(404)
+
+    def do_POST(self):
+        body = self._read_body()
+        if not self._simulate_link():
+            return self._reply(503)
+        if urlparse(self.path).path == "/api/todoes":
+            fields = dict(parse_qsl(body.decode()))
+            with self.state.lock:
+                self.state.records.append(fields)
+            return self._reply(201)
+        self._reply(404)
+
+    def do_PUT(self):
+        body = self._read_body()
+        if not self._simulate_link():
+            return self._reply(503)
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        with self.state.lock:
+            if query.get("comp") == "block":
+                self.state.uncommitted.setdefault(url.path, {})[query["blockid"]] = body
+                self.state.block_puts += 1
+                return self._reply(201)
+            if query.get("comp") == "blocklist":
+                staged = self.state.uncommitted.pop(url.path, {})
+                ids = [element.text for element in ElementTree.fromstring(body)]
+                if any(block_id not in staged for block_id in ids):
+                    return self._reply(400)
+                self.state.blobs[url.path] = b"".join(staged[block_id] for block_id in ids)
+            else:
+                self.state.blobs[url.path] = body
+        self._reply(201, headers={
+            "ETag": f"\"0x{random.getrandbits(48):X}\"",
+            "Last-Modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()),
+            "x-ms-request-server-encrypted": "false",
+        })
+
+
+def start_emulator(port=0, **link_options):
+    """Starts the emulator in a background thread and returns (server, base_url, connection_string)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), EmulatorHandler)
+    server.daemon_threads = True
+    server.state = EmulatorState(**link_options)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    connection_string = (
+        f"DefaultEndpointsProtocol=http;AccountName={ACCOUNT_NAME};AccountKey={ACCOUNT_KEY};"
+        f"BlobEndpoint={base_url}/{ACCOUNT_NAME};"
+    )
+    return server, base_url, connection_string
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the metadata API and blob storage.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=None, help="Upload bytes per second")
+    args = parser.parse_args()
+
+    server, base_url, connection_string = start_emulator(
+        args.port, latency=args.latency, failure_rate=args.failure_rate, bandwidth=args.bandwidth
+    )
+    print(f"api_base_url={base_url}")
+    print(f"azure_connection_string={connection_string}")
+    print("azure_container_name=images")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# Standard library imports
+import time
+from threading import Lock
+from contextvars import ContextVar
+from contextlib import contextmanager
+from collections import deque
+
+
+# Number of finished traces kept in memory
+RING_SIZE = 64
+
+
+
+class Trace:
+    """Named, timed spans of one button press, measured on the time.monotonic() clock."""
+
+    def __init__(self, name, start=None):
+        self.name = name
+        self.start = time.monotonic() if start is None else start
+        self.spans = []             # (name, start offset in seconds, duration in seconds)
+        self.on_update = None       # Called with the trace whenever a span is added after finish()
+        self.finished = False
+        self._lock = Lock()
+
+
+    def add(self, name, start, end=None):
+        """Records a span from absolute monotonic timestamps."""
+        end = time.monotonic() if end is None else end
+        with self._lock:
+            self.spans.append((name, start - self.start, end - start))
+            callback = self.on_update if self.finished else None
+        if callback is not None:
+            callback(self)
+
+
+    @contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+
+    def export(self):
+        """Returns the spans as (name, start, end) monotonic timestamps, e.g. to add them to a trace in another process."""
+        with self._lock:
+            return [(n, self.start + s, self.start + s + d) for n, s, d in self.spans]
+
+
+    def to_dict(self):
+        with self._lock:
+            spans = [dict(name=n, start=round(s, 4), duration=round(d, 4)) for n, s, d in self.spans]
+        return dict(name=self.name, spans=spans)
+
+
+
+class Tracer:
+    """Keeps the trace of the press being processed and a ring buffer of recent traces."""
+
+    def __init__(self, ring_size=RING_SIZE):
+        self.current = None
+        self.recent = deque(maxlen=ring_size)
+
+
+    def begin(self, name, start=None):
+        """Starts a new trace and makes it current, both process-wide and in the calling context."""
+        trace = Trace(name, start)
+        self.current = trace
+        _context_trace.set(trace)
+        return trace
+
+
+    def finish(self, on_update=None, trace=None):
+        """Stores a trace (by default the current one) in the ring buffer; later spans (e.g. playback) still reach on_update."""
+        trace = self.current if trace is None else trace
+        if trace is None:
+            return None
+        trace.on_update = on_update
+        trace.finished = True
+        self.recent.append(trace)
+        if self.current is trace:
+            self.current = None
+        if _context_trace.get(None) is trace:
+            _context_trace.set(None)
+        if on_update is not None:
+            on_update(trace)
+        return trace
+
+
+
+# Process-wide tracer used by all pipeline modules
+tracer = Tracer()
+
+# Trace of the press run by the current context. Overlapping runs (and the threads they start with
+# asyncio.to_thread, which copies the context) each see their own trace; plain threads fall back to tracer.current
+_context_trace = ContextVar("trace")
+
+
+def current():
+    """Returns the trace of the press being processed, or None (also in detached code)."""
+    return _context_trace.get(tracer.current)
+
+
+@contextmanager
+def detached():
+    """Keeps the spans of background work in the calling context out of the press being traced."""
+    token = _context_trace.set(None)
+    try:
+        yield
+    finally:
+        _context_trace.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Times a block as a span of the current trace (does nothing when no trace is active)."""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(records):
+    """Returns {stage: dict(count, p50, p95, p99)} from history records carrying a trace."""
+    durations = {}
+    for record in records:
+        trace = record.get("trace")
+        if not trace:
+            continue
+        per_stage = {}
+        for item in trace["spans"]:
+            per_stage[item["name"]] = per_stage.get(item["name"], 0.0) + item["duration"]
+        for stage, duration in per_stage.items():
+            durations.setdefault(stage, []).append(duration)
+
+    return {
+        stage: dict(
+            count = len(values),
+            p50 = percentile(values, 50),
+            p95 = percentile(values, 95),
+            p99 = percentile(values, 99),
+        )
+        for stage, values in durations.items()
+    }
+
+
+def main():
+    import json
+    import argparse
+    from history_store import HistoryStore, HISTORY_DB
+
+    parser = argparse.ArgumentParser(description="Summarize per-stage latency from the interaction history.")
+    parser.add_argument("--db", default=HISTORY_DB, help="History database")
+    parser.add_argument("--since", help="Only use records created at or after this ISO timestamp")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    history = HistoryStore(args.db, legacy_path=None)
+    records = history.since(args.since) if args.since else history.all()
+    history.close()
+    summary = summarize(records)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"{'stage':>24} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["p50"]):
+        print(f"{stage:>24} {stats['count']:6d} {stats['p50']:8.3f} {stats['p95']:8.3f} {stats['p99']:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
 # Standard library imports
 import os
-import json
+import time
+import random
+import socket
+import subprocess
 from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party imports
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from azure.storage.blob import BlobServiceClient
 
+# Local imports
+from history_store import HistoryStore
+from blob_upload import BandwidthLimiter, ResumableBlobUploader
+
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,86 +25,301 @@ load_dotenv()
 # Setup base directory for file paths
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
+# Server and upload configuration
+API_BASE_URL = os.getenv('api_base_url', "https://dotnetappsqldb20240420033344.azurewebsites.net")
+UPLOAD_CONCURRENCY = int(os.getenv('upload_concurrency', 4))   # Entries uploaded in parallel
+MAX_RETRIES = int(os.getenv('upload_max_retries', 4))          # Retries after the first failed attempt
+BACKOFF_BASE = 0.5                                              # First retry delay in seconds, doubled each time
+BACKOFF_MAX = 30                                                # Upper bound on a single retry delay in seconds
+REQUEST_TIMEOUT = 30                                            # Seconds before an HTTP request is abandoned
+
+# Blob upload configuration
+BLOCK_SIZE = int(os.getenv('upload_block_size_kb', 1024)) * 1024   # Size of each staged block
+COMPRESS_UPLOADS = os.getenv('upload_compress', 'false').lower() in ('1', 'true', 'yes')  # Re-encode as JPEG first
+JPEG_QUALITY = int(os.getenv('upload_jpeg_quality', 85))
+MAX_DIMENSION = int(os.getenv('upload_max_dimension', 0)) or None  # Downscale the longest side when compressing
+MAX_UPLOAD_KBPS = int(os.getenv('upload_max_kbps', 0))             # Total upload bandwidth cap, 0 for unlimited
+
+# Daemon configuration
+DAEMON_POLL_INTERVAL = 5        # Seconds between checks of the history store when file events are unavailable
+DAEMON_IDLE_RECHECK = 300       # Longest wait in seconds between checks while watching the history store
+SETTLE_TIME = 1                 # Seconds to let main.py finish writing a capture before uploading it
+OFFLINE_BACKOFF_MIN = 5         # First wait in seconds after the connectivity probe fails
+OFFLINE_BACKOFF_MAX = 300       # Longest wait in seconds between probes while offline
+PROBE_TIMEOUT = 3               # Seconds before the connectivity probe gives up
+FAILED_ROUND_BACKOFF_MAX = 300  # Longest wait in seconds after a round with failed entries while online
+ENTRY_BACKOFF_BASE = 30         # Seconds before the daemon retries an entry that failed once, doubled per failed attempt
+ENTRY_BACKOFF_MAX = 3600        # Upper bound on the wait before an entry is retried
+
+# Blob container client, created once in main()
+container_client = None
+
+
+def create_session(pool_size=UPLOAD_CONCURRENCY):
+    """ Creates a requests session whose keep-alive connection pool is shared by all upload threads. """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-def send_data_to_server(data):
+def create_container_client(connection_string=None, container_name=None):
+    """ Creates the blob container client that is reused for every upload. """
+    connection_string = connection_string or os.getenv('azure_connection_string')
+    container_name = container_name or os.getenv('azure_container_name')
+    # Retries are handled by with_retries(), so the SDK's own retry policy is disabled
+    blob_service_client = BlobServiceClient.from_connection_string(connection_string, retry_total=0)
+    return blob_service_client.get_container_client(container_name)
+
+def with_retries(func, *args, retries=None, **kwargs):
+    """ Calls func, retrying failures with jittered exponential backoff. """
+    retries = MAX_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"{func.__name__} failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def send_data_to_server(data, session=None):
     """ Sends data to a specified server via POST request. """
     # URL to which the POST request is sent
-    url = "https://dotnetappsqldb20240420033344.azurewebsites.net/api/todoes"
-    
-    # Sending POST request
-    requests.post(url, data=data)
+    url = f"{API_BASE_URL}/api/todoes"
+
+    # Sending POST request over the pooled session
+    response = (session or requests).post(url, data=data, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
 
-def is_internet_connected(url="http://www.google.com"):
-    """ Check if there is an internet connection by making a GET request to a given URL. """
+def is_internet_connected(url=None, timeout=PROBE_TIMEOUT):
+    """ Check if the upload server is reachable by opening a TCP connection to it (no HTTP request is made). """
+    url = urlparse(url or API_BASE_URL)
+    port = url.port or (443 if url.scheme == "https" else 80)
     try:
-        response = requests.get(url, timeout=100)  # Set a reasonable timeout
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        return True
-    except requests.RequestException as e:
+        with socket.create_connection((url.hostname, port), timeout=timeout):
+            return True
+    except OSError as e:
         print(f"Internet connection check failed: {e}")
         return False
 
-def upload_image_to_blob(file_path):
-    """ Uploads a file to Azure Blob Storage. """
-    try:
-        # Create a blob client using the local file name as the name for the blob
-        blob_client = container_client.get_blob_client(file_path)
+def create_blob_uploader(history):
+    """ Creates the block-based uploader configured from the environment. """
+    limiter = BandwidthLimiter(MAX_UPLOAD_KBPS * 1024) if MAX_UPLOAD_KBPS else None
+    return ResumableBlobUploader(
+        history, block_size=BLOCK_SIZE, limiter=limiter,
+        compress=COMPRESS_UPLOADS, quality=JPEG_QUALITY, max_dimension=MAX_DIMENSION,
+    )
 
-        # Upload the file
-        with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def upload_image_to_blob(file_path, client=None, uploader=None):
+    """ Uploads a file to Azure Blob Storage, in resumable blocks when an uploader is given. """
+    if uploader is not None:
+        uploader.upload(client or container_client, file_path)
+        return
 
-def main():
-    global container_client
-    
-    # Azure storage configuration
-    connection_string = os.getenv('azure_connection_string')
-    container_name = os.getenv('azure_container_name')
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    container_client = blob_service_client.get_container_client(container_name)
-    
-    seen_images = set()
-    
-    # Get the list of images already processed
+    # Create a blob client using the local file name as the name for the blob
+    blob_client = (client or container_client).get_blob_client(file_path)
+
+    # Upload the file
+    with open(file_path, "rb") as data:
+        blob_client.upload_blob(data, overwrite=True)
+
+def fetch_seen_images(session):
+    """ Gets the list of images already processed by the server. """
     try:
-        response = requests.get("https://dotnetappsqldb20240420033344.azurewebsites.net/api/test", timeout=10)  # Timeout parameter is optional but recommended
+        response = session.get(f"{API_BASE_URL}/api/test", timeout=10)
         response.raise_for_status()  # Raise an exception for HTTP error codes
         seen_images = set(x.get('ImageUrl') for x in response.json())
-        print("Seen images: ", len(list(seen_images)))
+        print("Seen images: ", len(seen_images))
+        return seen_images
     except requests.exceptions.RequestException as e:
         print(f"An error occurred: {e}")
-    
+        return set()
 
-    # Load history data from JSON file
-    with open(os.path.join(base_dir, "data", "history.json")) as file:
-        history = json.load(file)
-
-    # Process each history entry
-    for entry in history:
-        if entry["filename"][5:] not in seen_images:
-            print(f"Processing {entry['filename']}...")
+def upload_entry(entry, history, session, client, seen_images=frozenset(), uploader=None):
+    """ Uploads whatever is still missing for one history entry; returns True once both parts are confirmed. """
+    print(f"Processing {entry['filename']}...")
+    try:
+        # Metadata, unless a previous run (or the server listing) already confirmed it
+        if not entry["metadataUploaded"] and entry["filename"][5:] not in seen_images:
             cur_entry = {
                 "Description": entry["caption"],
                 "CreatedDate": datetime.fromisoformat(entry["createdAt"]),
                 "ImageURL": entry["filename"],
             }
-            
-            send_data_to_server(cur_entry)
-            upload_image_to_blob(entry["filename"])
-        
-        # Remove the picture after uploading
+            with_retries(send_data_to_server, cur_entry, session)
+        history.mark_metadata_uploaded(entry["id"])
+
+        # Image blob, unless a previous run already confirmed it or the photo store evicted the photo to stay under its quota
+        if not entry["blobUploaded"] and not entry.get("photoEvicted"):
+            with_retries(upload_image_to_blob, entry["filename"], client, uploader)
+            history.mark_blob_uploaded(entry["id"])
+    except Exception as e:
+        # Count the failure on the entry so the daemon retries it less and less often
+        attempts = entry.get("uploadAttempts", 0) + 1
+        delay = min(ENTRY_BACKOFF_MAX, ENTRY_BACKOFF_BASE * 2 ** (attempts - 1))
+        history.update_extra(entry["id"], uploadAttempts=attempts, retryAt=time.time() + delay)
+        print(f"An error occurred while uploading {entry['filename']} (attempt {attempts}, next in {delay}s): {e}")
+        return False
+
+    # Remove the picture only after both its metadata and its blob are confirmed
+    try:
         os.remove(entry["filename"])
+    except FileNotFoundError:
+        pass
+    history.mark_uploaded([entry["id"]])
+    return True
+
+def upload_pending(history, session, client, seen_images=frozenset(), concurrency=UPLOAD_CONCURRENCY, uploader=None, retry_all=True):
+    """ Uploads the pending history entries on a bounded pool of threads; returns (uploaded, failed).
+
+    Without retry_all, entries that failed recently are skipped until their
+    per-entry backoff (retryAt) has passed.
 
-    # Clear the history in the JSON file
-    with open(os.path.join(base_dir, "data", "history.json"), "w") as file:
-        json.dump([], file)
+    Progress is recorded per entry in the history store (metadata, blob and
+    upload flags), so an interrupted run resumes where it stopped and only the
+    entries not yet confirmed are reconciled; no separate sync cursor is kept.
+    """
+    pending = history.pending()
+    if not retry_all:
+        now = time.time()
+        pending = [entry for entry in pending if entry.get("retryAt", 0) <= now]
+    uploader = uploader or create_blob_uploader(history)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda entry: upload_entry(entry, history, session, client, seen_images, uploader), pending))
+
+    uploaded = sum(results)
+    return uploaded, len(results) - uploaded
+
+def lower_priority():
+    """ Runs this process at idle CPU and I/O priority so it never competes with captioning. """
+    try:
+        os.nice(19)
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError) as e:
+        print(f"Could not lower CPU priority: {e}")
+    try:
+        subprocess.run(["ionice", "-c", "3", "-p", str(os.getpid())], check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not lower I/O priority: {e}")
+
+class HistoryWatcher:
+    """ Waits for writes to the history database via inotify, falling back to a plain timeout. """
+
+    def __init__(self, db_path):
+        # SQLite in WAL mode appends to <db>-wal, so watch the directory and match the database's files by name
+        self.prefix = os.path.basename(db_path)
+        try:
+            from inotify_simple import INotify, flags
+            self.inotify = INotify()
+            self.inotify.add_watch(os.path.dirname(os.path.abspath(db_path)), flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO)
+        except (ImportError, OSError) as e:
+            print(f"File watching unavailable ({e}), polling the history store instead")
+            self.inotify = None
+
+    def wait(self, timeout):
+        """ Blocks until the history database is written or the timeout expires. """
+        if self.inotify is None:
+            time.sleep(timeout)
+            return False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            events = self.inotify.read(timeout=max(1, int(remaining * 1000)))
+            # Photos written to the same directory are ignored; their record follows once the caption is ready
+            if any(event.name.startswith(self.prefix) for event in events):
+                return True
+
+def run_daemon(poll_interval=DAEMON_POLL_INTERVAL):
+    """ Keeps uploading new captures soon after they are created, backing off while offline. """
+    global container_client
+
+    lower_priority()
+    session = create_session()
+    container_client = create_container_client()
+    history = HistoryStore()
+    watcher = HistoryWatcher(history.path)
+    offline_delay = OFFLINE_BACKOFF_MIN
+    failed_delay = OFFLINE_BACKOFF_MIN
+
+    try:
+        while True:
+            # Entries waiting out their per-entry backoff do not count, so a failing entry does not keep the daemon busy
+            due, next_retry = history.pending_due(time.time())
+            if due:
+                if not is_internet_connected():
+                    # Probe less and less often while the link stays down
+                    print(f"Offline, next check in {offline_delay}s")
+                    time.sleep(offline_delay)
+                    offline_delay = min(OFFLINE_BACKOFF_MAX, offline_delay * 2)
+                    continue
+
+                offline_delay = OFFLINE_BACKOFF_MIN
+                uploaded, failed = upload_pending(history, session, container_client, retry_all=False)
+                if uploaded or failed:
+                    print(f"Uploaded {uploaded} entries ({failed} failed)")
+                if failed:
+                    # Entries that keep failing while online (missing file, rejected request) get rounds further apart
+                    time.sleep(failed_delay)
+                    failed_delay = min(FAILED_ROUND_BACKOFF_MAX, failed_delay * 2)
+                    continue
+                if uploaded:
+                    failed_delay = OFFLINE_BACKOFF_MIN
+
+                due, next_retry = history.pending_due(time.time())
+                if due:
+                    continue
+
+            # Sleep until main.py records a new capture or the next entry's backoff ends
+            timeout = poll_interval if watcher.inotify is None else DAEMON_IDLE_RECHECK
+            if next_retry is not None:
+                timeout = min(timeout, max(0, next_retry - time.time()))
+            if watcher.wait(timeout):
+                time.sleep(SETTLE_TIME)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        history.close()
+        session.close()
+
+def main(reconcile=False):
+    global container_client
+
+    # Shared HTTP connection pool and Azure storage client, reused by every upload
+    session = create_session()
+    container_client = create_container_client()
+
+    # The local manifest tracks what was uploaded; the full server listing is only needed to rebuild it
+    seen_images = fetch_seen_images(session) if reconcile else frozenset()
+
+    # Load only the entries that have not been uploaded yet
+    history = HistoryStore()
+    print(f"Syncing {history.pending_count()} pending entries...")
+    start_time = time.perf_counter()
+    uploaded, failed = upload_pending(history, session, container_client, seen_images)
+    elapsed = time.perf_counter() - start_time
+    print(f"Uploaded {uploaded} entries ({failed} failed) in {elapsed:.1f}s with {UPLOAD_CONCURRENCY} workers")
+
+    history.close()
+    session.close()
 
 
 
 if __name__ == "__main__":
-    if is_internet_connected():
-        main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Upload captured images and captions.")
+    parser.add_argument("--reconcile", action="store_true", help="Check pending entries against the full server image list")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and upload new captures as they appear")
+    args = parser.parse_args()
+
+    if args.daemon:
+        run_daemon()
+    elif is_internet_connected():
+        main(reconcile=args.reconcile)
     else:
-        print("--- No internet connection available. ---")
\ No newline at end of file
+        print("--- No internet connection available. ---")